@@ -0,0 +1,101 @@
+"""
+Measures click-flush throughput on a single hot URL with one counter slot versus several.
+
+Simulates --workers uvicorn workers, each with its own connection, repeatedly flushing a batch
+of clicks for the same URL for --seconds, first with every flush on slot 0 and then with the
+slot rotation ClickBuffer uses. Prints flushes per second and checks that the slots sum to the
+number of clicks written. Requires DATABASE_URL and asyncpg:
+
+    python -m benchmarks.click_contention --workers 8 --slots 8 --seconds 10
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import project.redirect_repository
+
+BENCH_USER_EMAIL = "click-benchmark@example.invalid"
+
+BENCH_ALIAS = "click-benchmark-hot-url"
+
+
+async def seed(pool) -> str:
+    user_id = await pool.fetchval(
+        """
+        INSERT INTO "User" (email, password, "updatedAt") VALUES ($1, '', now())
+        ON CONFLICT (email) DO UPDATE SET "updatedAt" = now()
+        RETURNING id
+        """,
+        BENCH_USER_EMAIL,
+    )
+    return await pool.fetchval(
+        """
+        INSERT INTO "Url" ("originalUrl", "shortUrl", alias, "userId", "updatedAt")
+        VALUES ('https://example.com/', $1, $1, $2, now())
+        ON CONFLICT ("shortUrl") DO UPDATE SET "updatedAt" = now()
+        RETURNING id
+        """,
+        BENCH_ALIAS,
+        user_id,
+    )
+
+
+async def run_round(
+    repository, url_id: str, workers: int, slots: int, seconds: float, batch: int
+) -> int:
+    await repository.pool.execute('DELETE FROM "Analytics" WHERE "urlId" = $1', url_id)
+    deadline = time.perf_counter() + seconds
+    flushes = 0
+
+    async def worker():
+        nonlocal flushes
+        slot = random.randrange(slots)
+        while time.perf_counter() < deadline:
+            await repository.increment_clicks(
+                {url_id: batch}, slot, {url_id: BENCH_ALIAS}
+            )
+            slot = (slot + 1) % slots
+            flushes += 1
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    total = await repository.pool.fetchval(
+        'SELECT coalesce(sum(clicks), 0) FROM "Analytics" WHERE "urlId" = $1', url_id
+    )
+    assert total == flushes * batch, f"lost clicks: {total} != {flushes * batch}"
+    return flushes
+
+
+async def main(args: argparse.Namespace) -> None:
+    repository = project.redirect_repository.AsyncpgRedirectRepository(
+        project.redirect_repository._asyncpg_dsn(os.environ["DATABASE_URL"]),
+        min_size=args.workers,
+        max_size=args.workers,
+    )
+    await repository.connect()
+    try:
+        url_id = await seed(repository.pool)
+        for slots in (1, args.slots):
+            flushes = await run_round(
+                repository, url_id, args.workers, slots, args.seconds, args.batch
+            )
+            print(
+                f"slots={slots:<3} workers={args.workers:<3}"
+                f" {flushes / args.seconds:10.0f} flushes/s"
+            )
+    finally:
+        await repository.pool.execute(
+            'DELETE FROM "User" WHERE email = $1', BENCH_USER_EMAIL
+        )
+        await repository.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--batch", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""
+Compares the redirect alias lookup through Prisma with the asyncpg fast path under the same load.
+
+Seeds a throwaway user with --urls mappings, replays the same random sequence of aliases through
+both repositories at a fixed concurrency, prints throughput and latency percentiles, and deletes
+the seeded rows again. Both paths run as the app runs them: behind the database circuit breaker
+with the per-query timeout and query instrumentation, with --concurrency pooled connections each. Requires DATABASE_URL, a generated Prisma client and asyncpg:
+
+    python -m benchmarks.redirect_lookup --urls 1000 --requests 20000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from typing import List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import project.query_instrumentation
+import project.redirect_repository
+
+BENCH_USER_EMAIL = "redirect-benchmark@example.invalid"
+
+
+async def seed(pool, count: int) -> List[str]:
+    user_id = await pool.fetchval(
+        """
+        INSERT INTO "User" (email, password, "updatedAt") VALUES ($1, '', now())
+        ON CONFLICT (email) DO UPDATE SET "updatedAt" = now()
+        RETURNING id
+        """,
+        BENCH_USER_EMAIL,
+    )
+    aliases = [f"bench-{i}" for i in range(count)]
+    await pool.executemany(
+        """
+        INSERT INTO "Url" ("originalUrl", "shortUrl", alias, "userId", "updatedAt")
+        VALUES ($1, $2, $2, $3, now())
+        ON CONFLICT ("shortUrl") DO NOTHING
+        """,
+        [(f"https://example.com/{alias}", alias, user_id) for alias in aliases],
+    )
+    return aliases
+
+
+async def cleanup(pool) -> None:
+    await pool.execute('DELETE FROM "User" WHERE email = $1', BENCH_USER_EMAIL)
+
+
+async def run_load(repository, workload: List[str], concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    queue = iter(workload)
+
+    async def worker():
+        for alias in queue:
+            started = time.perf_counter()
+            await repository.find_by_alias(alias)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def report(name: str, latencies: List[float], elapsed: float) -> None:
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:8} {len(latencies) / elapsed:10.0f} req/s"
+        f"  p50 {quantiles[49] * 1000:7.2f}ms"
+        f"  p95 {quantiles[94] * 1000:7.2f}ms"
+        f"  p99 {quantiles[98] * 1000:7.2f}ms"
+    )
+
+
+def _with_connection_limit(database_url: str, limit: int) -> str:
+    parts = urlsplit(database_url)
+    query = dict(parse_qsl(parts.query))
+    query["connection_limit"] = str(limit)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+async def main(args: argparse.Namespace) -> None:
+    database_url = os.environ["DATABASE_URL"]
+    prisma_client = project.query_instrumentation.InstrumentedPrisma(
+        auto_register=True,
+        datasource={"url": _with_connection_limit(database_url, args.concurrency)},
+    )
+    await prisma_client.connect()
+    fast_path = project.redirect_repository.AsyncpgRedirectRepository(
+        project.redirect_repository._asyncpg_dsn(database_url),
+        min_size=args.concurrency,
+        max_size=args.concurrency,
+    )
+    await fast_path.connect()
+    try:
+        aliases = await seed(fast_path.pool, args.urls)
+        rng = random.Random(args.seed)
+        workload = [rng.choice(aliases) for _ in range(args.requests)]
+        repositories = {
+            "prisma": project.redirect_repository.PrismaRedirectRepository(),
+            "asyncpg": fast_path,
+        }
+        for name, repository in repositories.items():
+            await run_load(
+                repository, workload[: args.concurrency * 10], args.concurrency
+            )
+            started = time.perf_counter()
+            latencies = await run_load(repository, workload, args.concurrency)
+            report(name, latencies, time.perf_counter() - started)
+    finally:
+        await cleanup(fast_path.pool)
+        await fast_path.disconnect()
+        await prisma_client.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--urls", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
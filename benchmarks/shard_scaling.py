@@ -0,0 +1,97 @@
+"""
+Measures shorten and redirect throughput as URL mappings are spread over more shards.
+
+Reads the shards from URL_SHARD_DATABASE_URLS and, for 1..N of them, runs --concurrency
+tasks for --seconds that each create a Url through ShardRouter and then resolve it by
+alias, as the shorten and redirect endpoints do. Prints operations per second for every
+shard count. Requires DATABASE_URL for the primary database and the schema on every
+shard, with migrations/url_shards.sql applied, e.g. from docker-compose.shards.yml:
+
+    python -m benchmarks.shard_scaling --concurrency 64 --seconds 10
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import prisma
+import prisma.models
+import project.sharding
+
+BENCH_USER_EMAIL = "shard-benchmark@example.invalid"
+
+
+async def run_round(
+    router: project.sharding.ShardRouter,
+    user_id: str,
+    concurrency: int,
+    seconds: float,
+) -> int:
+    deadline = time.perf_counter() + seconds
+    operations = 0
+
+    async def worker():
+        nonlocal operations
+        while time.perf_counter() < deadline:
+            alias = f"bench-{uuid.uuid4().hex[:12]}"
+            await router.client_for_alias(alias).url.create(
+                data={
+                    "originalUrl": "https://example.com/",
+                    "shortUrl": alias,
+                    "alias": alias,
+                    "userId": user_id,
+                }
+            )
+            url = await router.find_url_by_alias(alias)
+            assert url is not None, f"{alias} not found on its shard"
+            operations += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return operations
+
+
+async def main(args: argparse.Namespace) -> None:
+    shard_urls = project.sharding.parse_shard_urls(
+        project.sharding.URL_SHARD_DATABASE_URLS
+    )
+    if not shard_urls:
+        raise SystemExit("URL_SHARD_DATABASE_URLS is not set")
+    primary = prisma.Prisma(auto_register=True)
+    await primary.connect()
+    user = await prisma.models.User.prisma().upsert(
+        where={"email": BENCH_USER_EMAIL},
+        data={
+            "create": {"email": BENCH_USER_EMAIL, "password": ""},
+            "update": {},
+        },
+    )
+    names = list(shard_urls)
+    try:
+        for count in range(1, len(names) + 1):
+            router = project.sharding.ShardRouter(
+                {name: shard_urls[name] for name in names[:count]}
+            )
+            await router.connect()
+            try:
+                operations = await run_round(
+                    router, user.id, args.concurrency, args.seconds
+                )
+                for client in router.clients.values():
+                    await client.url.delete_many(where={"userId": user.id})
+            finally:
+                await router.disconnect()
+            print(
+                f"shards={count:<3} concurrency={args.concurrency:<4}"
+                f" {operations / args.seconds:10.0f} shorten+redirect/s"
+            )
+    finally:
+        await prisma.models.User.prisma().delete(where={"id": user.id})
+        await primary.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    asyncio.run(main(parser.parse_args()))
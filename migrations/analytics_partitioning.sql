@@ -0,0 +1,98 @@
+-- Converts the "Analytics" table into one range-partitioned by month on "bucket".
+--
+-- Prisma has no notion of declarative partitioning, so this script does the conversion itself
+-- and works on either shape of the table:
+--
+-- * A fresh database: run `prisma db push` first, then this script.
+-- * An existing deployment whose "Analytics" still has the old `id` primary key and no
+--   "bucket" column: run this script BEFORE `prisma db push`, which cannot add a required
+--   column to a populated table or swap its primary key. Each row is bucketed by the month
+--   of its "updatedAt", rows are merged per (urlId, bucket, slot), and "id" is dropped.
+--   Then run `prisma db push` for the remaining schema changes.
+--
+--     psql "$DATABASE_URL" -f migrations/analytics_partitioning.sql
+--
+-- Running it again once the table is partitioned does nothing. Afterwards the app creates
+-- upcoming monthly partitions and drops those older than ANALYTICS_RETENTION_MONTHS itself
+-- (see project/analytics_partitions.py).
+
+BEGIN;
+
+DO $$
+DECLARE
+    bucket_expr TEXT := 'date_trunc(''month'', "updatedAt")::date';
+    slot_expr   TEXT := '0';
+    first_month DATE;
+    month       DATE;
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM pg_partitioned_table
+        JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid
+        WHERE pg_class.relname = 'Analytics'
+    ) THEN
+        RAISE NOTICE '"Analytics" is already partitioned';
+        RETURN;
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'Analytics' AND column_name = 'bucket'
+    ) THEN
+        bucket_expr := '"bucket"';
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'Analytics' AND column_name = 'slot'
+    ) THEN
+        slot_expr := '"slot"';
+    END IF;
+
+    ALTER TABLE "Analytics" RENAME TO "Analytics_unpartitioned";
+    ALTER TABLE "Analytics_unpartitioned" RENAME CONSTRAINT "Analytics_pkey" TO "Analytics_unpartitioned_pkey";
+
+    CREATE TABLE "Analytics" (
+        "urlId"     TEXT         NOT NULL,
+        "bucket"    DATE         NOT NULL,
+        "slot"      INTEGER      NOT NULL DEFAULT 0,
+        "clicks"    INTEGER      NOT NULL DEFAULT 0,
+        "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        "updatedAt" TIMESTAMP(3) NOT NULL,
+        "userId"    TEXT,
+        -- The primary key leads with ("urlId", "bucket"), which is the index every analytics read uses.
+        CONSTRAINT "Analytics_pkey" PRIMARY KEY ("urlId", "bucket", "slot"),
+        CONSTRAINT "Analytics_urlId_fkey" FOREIGN KEY ("urlId") REFERENCES "Url"("id") ON DELETE CASCADE ON UPDATE CASCADE,
+        CONSTRAINT "Analytics_userId_fkey" FOREIGN KEY ("userId") REFERENCES "User"("id") ON DELETE SET NULL ON UPDATE CASCADE
+    ) PARTITION BY RANGE ("bucket");
+
+    -- Catches writes for months whose partition has not been created yet.
+    CREATE TABLE "Analytics_default" PARTITION OF "Analytics" DEFAULT;
+
+    EXECUTE format('SELECT min(%s) FROM "Analytics_unpartitioned"', bucket_expr) INTO first_month;
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', coalesce(first_month, now())),
+            date_trunc('month', now()) + interval '2 months',
+            interval '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF "Analytics" FOR VALUES FROM (%L) TO (%L)',
+            'Analytics_' || to_char(month, 'YYYY_MM'),
+            month,
+            (month + interval '1 month')::date
+        );
+    END LOOP;
+
+    EXECUTE format(
+        'INSERT INTO "Analytics" ("urlId", "bucket", "slot", "clicks", "createdAt", "updatedAt", "userId") '
+        'SELECT "urlId", %1$s, %2$s, sum("clicks")::int, min("createdAt"), max("updatedAt"), max("userId") '
+        'FROM "Analytics_unpartitioned" GROUP BY "urlId", %1$s, %2$s',
+        bucket_expr,
+        slot_expr
+    );
+
+    DROP TABLE "Analytics_unpartitioned";
+END $$;
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Prepares a URL shard database (one listed in URL_SHARD_DATABASE_URLS).
+--
+-- Users live only in the primary database, so Url and Analytics rows on a shard cannot keep
+-- their foreign keys to "User". Run this on every shard after `prisma db push` and
+-- migrations/analytics_partitioning.sql, and again after any later `prisma db push`, which
+-- re-creates the constraints:
+--
+--     psql "$SHARD_URL" -f migrations/url_shards.sql
+--
+-- Do not run it on the primary database unless the primary is also listed as a shard.
+
+BEGIN;
+
+ALTER TABLE "Url" DROP CONSTRAINT IF EXISTS "Url_userId_fkey";
+ALTER TABLE "Analytics" DROP CONSTRAINT IF EXISTS "Analytics_userId_fkey";
+
+COMMIT;
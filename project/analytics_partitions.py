@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import prisma
+import project.circuit_breaker
+import project.sharding
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_RETENTION_MONTHS = int(os.environ.get("ANALYTICS_RETENTION_MONTHS", "13"))
+
+ANALYTICS_PARTITIONS_AHEAD = 2
+
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = 3600.0
+
+PARTITION_NAME = re.compile(r"^Analytics_(\d{4})_(\d{2})$")
+
+LIST_PARTITIONS_SQL = """
+SELECT child.relname AS name
+FROM pg_inherits
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE parent.relname = 'Analytics'
+"""
+
+IS_PARTITIONED_SQL = """
+SELECT count(*) AS partitioned
+FROM pg_partitioned_table
+JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid
+WHERE pg_class.relname = 'Analytics'
+"""
+
+
+def month_bucket(value: Optional[datetime] = None) -> datetime:
+    """
+    Returns the first instant of the UTC month containing `value`, which is the Analytics partition key.
+    """
+    value = (value or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(bucket: datetime, months: int) -> datetime:
+    index = bucket.year * 12 + bucket.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(bucket: datetime) -> str:
+    return f"Analytics_{bucket:%Y_%m}"
+
+
+def retention_window() -> Tuple[datetime, datetime]:
+    """
+    Returns the [start, end) bucket range still retained, for partition-prunable analytics reads.
+    """
+    current = month_bucket()
+    return add_months(current, 1 - ANALYTICS_RETENTION_MONTHS), add_months(current, 1)
+
+
+async def ensure_partitions(client: prisma.Prisma) -> None:
+    """
+    Creates the partitions for the current month and the next ANALYTICS_PARTITIONS_AHEAD months.
+    """
+    current = month_bucket()
+    for offset in range(ANALYTICS_PARTITIONS_AHEAD + 1):
+        start = add_months(current, offset)
+        end = add_months(start, 1)
+        await client.execute_raw(
+            f'CREATE TABLE IF NOT EXISTS "{partition_name(start)}" PARTITION OF "Analytics" '
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        )
+
+
+async def drop_expired_partitions(client: prisma.Prisma) -> List[str]:
+    """
+    Drops monthly partitions that ended before the retention window.
+
+    Dropping a partition discards its rows without scanning them, unlike a DELETE.
+
+    Returns:
+        List[str]: The names of the partitions dropped.
+    """
+    retained_from = retention_window()[0]
+    rows = await client.query_raw(LIST_PARTITIONS_SQL)
+    dropped = []
+    for row in rows:
+        match = PARTITION_NAME.match(row["name"])
+        if match is None:
+            continue
+        bucket = datetime(
+            int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc
+        )
+        if bucket < retained_from:
+            await client.execute_raw(f'DROP TABLE IF EXISTS "{row["name"]}"')
+            dropped.append(row["name"])
+    return dropped
+
+
+async def run_partition_maintenance(
+    interval: float = PARTITION_MAINTENANCE_INTERVAL_SECONDS,
+) -> None:
+    """
+    Keeps upcoming partitions created and expired ones dropped on every database holding
+    Analytics. Every statement is idempotent, so it is safe for all workers to run this. The
+    DDL runs under the maintenance query budget rather than the per-request one.
+    """
+    clients = project.sharding.database_clients()
+    while clients:
+        for client in list(clients):
+            try:
+                async with project.circuit_breaker.maintenance_transaction(
+                    client
+                ) as transaction:
+                    rows = await transaction.query_raw(IS_PARTITIONED_SQL)
+                    if not rows[0]["partitioned"]:
+                        logger.info(
+                            "Analytics is not partitioned; run migrations/analytics_partitioning.sql"
+                        )
+                        clients.remove(client)
+                        continue
+                    await ensure_partitions(transaction)
+                    for name in await drop_expired_partitions(transaction):
+                        logger.info("Dropped expired analytics partition %s", name)
+            except Exception:
+                logger.exception("Analytics partition maintenance failed")
+        await asyncio.sleep(interval)
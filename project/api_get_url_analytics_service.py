@@ -2,6 +2,10 @@ from typing import Dict, List, Optional
 
 import prisma
 import prisma.models
+import project.analytics_partitions
+import project.get_url_analytics_service
+import project.http_caching
+import project.sharding
 from pydantic import BaseModel
 
 
@@ -17,39 +21,83 @@ class ApiGetUrlAnalyticsResponse(BaseModel):
     geographicData: List[Dict[str, int]]
 
 
-async def api_get_url_analytics(urlId: str, ApiKey: str) -> ApiGetUrlAnalyticsResponse:
+async def load_api_url_analytics(
+    urlId: str, ApiKey: str
+) -> List[prisma.models.Analytics]:
     """
-    Retrieve analytics for URLs via API.
-
-    Args:
-    urlId (str): The unique identifier of the URL whose analytics are being requested.
-    ApiKey (str): The API key provided by the user for authentication.
+    Verifies the API key and fetches every click counter slot recorded for the URL within the retention window.
 
-    Returns:
-    ApiGetUrlAnalyticsResponse: Response model containing the analytics data for a specific URL.
-
-    This function first verifies the provided ApiKey against stored ApiKeys for authentication.
-    Then, retrieves the analytics data of the specified URL using its urlId and aggregates geographic
-    data of clicks. It finally returns this data in the form of an ApiGetUrlAnalyticsResponse object.
+    Raises:
+        ValueError: If the API key is unknown or the URL has no analytics.
     """
     api_key_record = await prisma.models.ApiKey.prisma().find_unique(
         where={"key": ApiKey}
     )
     if api_key_record is None:
         raise ValueError("Invalid API Key")
-    analytics_records = await prisma.models.Analytics.prisma().find_many(
-        where={"urlId": urlId}, include={"Url": True}
+    client = await project.sharding.find_client_for_url_id(urlId)
+    if client is None:
+        raise ValueError("URL ID not found")
+    start, end = project.analytics_partitions.retention_window()
+    analytics_records = await client.analytics.find_many(
+        where={"urlId": urlId, "bucket": {"gte": start, "lt": end}}
     )
     if not analytics_records:
         raise ValueError("URL ID not found")
+    return analytics_records
+
+
+def api_url_analytics_cache_headers(
+    urlId: str, analytics_records: List[prisma.models.Analytics]
+) -> Dict[str, str]:
+    """
+    Derives the validators of an analytics response from its counter slots' updatedAt.
+
+    Responses are marked private because they are only served to API key holders.
+    """
+    updated_at = max((analytics.updatedAt for analytics in analytics_records))
+    return project.http_caching.cache_headers(
+        project.http_caching.make_etag(
+            urlId,
+            len(analytics_records),
+            sum((analytics.clicks for analytics in analytics_records)),
+            updated_at,
+        ),
+        updated_at,
+        f"private, max-age={project.get_url_analytics_service.ANALYTICS_CACHE_MAX_AGE_SECONDS}",
+    )
+
+
+def build_api_url_analytics_response(
+    urlId: str, analytics_records: List[prisma.models.Analytics]
+) -> ApiGetUrlAnalyticsResponse:
     geographic_data: List[Dict[str, int]] = []
-    response = ApiGetUrlAnalyticsResponse(
+    return ApiGetUrlAnalyticsResponse(
         urlId=urlId,
         clicks=sum((analytics.clicks for analytics in analytics_records)),
-        createdAt=str(analytics_records[0].createdAt),
+        createdAt=str(min((analytics.createdAt for analytics in analytics_records))),
         mostRecentClick=str(
             max((analytics.updatedAt for analytics in analytics_records))
         ),
         geographicData=geographic_data,
     )
-    return response
+
+
+async def api_get_url_analytics(urlId: str, ApiKey: str) -> ApiGetUrlAnalyticsResponse:
+    """
+    Retrieve analytics for URLs via API.
+
+    Args:
+    urlId (str): The unique identifier of the URL whose analytics are being requested.
+    ApiKey (str): The API key provided by the user for authentication.
+
+    Returns:
+    ApiGetUrlAnalyticsResponse: Response model containing the analytics data for a specific URL.
+
+    This function first verifies the provided ApiKey against stored ApiKeys for authentication.
+    Then, retrieves the analytics data of the specified URL using its urlId and aggregates geographic
+    data of clicks. It finally returns this data in the form of an ApiGetUrlAnalyticsResponse object.
+    """
+    return build_api_url_analytics_response(
+        urlId, await load_api_url_analytics(urlId, ApiKey)
+    )
@@ -1,7 +1,7 @@
 from typing import Optional
 
-import prisma
-import prisma.models
+import project.redirect_table
+import project.sharding
 from pydantic import BaseModel
 
 
@@ -31,14 +31,15 @@ async def api_shorten_url(
     short_url_stub = "http://short.url/"
     alias_if_required = custom_alias if custom_alias else "generatedAlias123"
     shortened_url = short_url_stub + alias_if_required
-    url_entry = await prisma.models.Url.prisma().create(
-        data={
+    url_entry = await project.sharding.create_url(
+        {
             "originalUrl": original_url,
             "shortUrl": shortened_url,
             "alias": alias_if_required,
             "userId": "UUID-of-the-user",
         }
     )
+    project.redirect_table.record_url_write(url_entry)
     return ApiShortenUrlResponse(
         original_url=url_entry.originalUrl,
         shortened_url=url_entry.shortUrl,
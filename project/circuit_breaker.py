@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from typing import AsyncIterator, Iterator, Tuple, Type
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+import prisma
+import prisma.errors
+import project.metrics
+
+logger = logging.getLogger(__name__)
+
+DB_QUERY_TIMEOUT_SECONDS = float(os.environ.get("DB_QUERY_TIMEOUT_SECONDS", "2"))
+
+DB_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("DB_BREAKER_FAILURE_THRESHOLD", "5"))
+
+DB_BREAKER_RESET_SECONDS = float(os.environ.get("DB_BREAKER_RESET_SECONDS", "10"))
+
+MAINTENANCE_QUERY_TIMEOUT_SECONDS = float(
+    os.environ.get("MAINTENANCE_QUERY_TIMEOUT_SECONDS", "300")
+)
+
+CLOSED = "closed"
+
+OPEN = "open"
+
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+db_breaker_state = project.metrics.Gauge(
+    "db_breaker_state",
+    "Database circuit breaker state: 0 closed, 1 open, 2 half-open.",
+    ["breaker"],
+)
+
+db_breaker_rejections_total = project.metrics.Counter(
+    "db_breaker_rejections_total",
+    "Database calls rejected without being attempted because the breaker was open.",
+    ["breaker"],
+)
+
+db_query_timeouts_total = project.metrics.Counter(
+    "db_query_timeouts_total",
+    "Database calls abandoned after DB_QUERY_TIMEOUT_SECONDS.",
+    ["breaker"],
+)
+
+
+_in_maintenance: ContextVar[bool] = ContextVar("in_maintenance", default=False)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of attempting a call while the breaker is open.
+
+    `retry_after` is the number of whole seconds until this breaker lets a probe through.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker with a per-call timeout.
+
+    After `failure_threshold` consecutive failures the breaker opens and rejects calls
+    immediately for `reset_timeout` seconds. It then lets a single probe call through;
+    success closes the breaker, failure re-opens it. Exceptions listed in `ignored`
+    (such as unique violations) mean the database answered, so they count as successes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = DB_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = DB_BREAKER_RESET_SECONDS,
+        call_timeout: float = DB_QUERY_TIMEOUT_SECONDS,
+        ignored: Tuple[Type[BaseException], ...] = (),
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.ignored = ignored
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._set_state(CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        db_breaker_state.set(STATE_VALUES[state], breaker=self.name)
+
+    def _before_call(self) -> bool:
+        if self.state == CLOSED:
+            return False
+        if (
+            self.state == OPEN
+            and time.monotonic() - self.opened_at >= self.reset_timeout
+        ):
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        db_breaker_rejections_total.inc(breaker=self.name)
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        raise CircuitOpenError(
+            f"{self.name} circuit is open", max(1, math.ceil(remaining))
+        )
+
+    def _record_success(self) -> None:
+        self.failures = 0
+        if self.state != CLOSED:
+            logger.info("%s circuit closed", self.name)
+            self._set_state(CLOSED)
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(
+                    "%s circuit opened after %d failures", self.name, self.failures
+                )
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """
+        Runs the enclosed database call under the breaker and the call timeout.
+
+        Calls made inside `maintenance()` bypass the breaker and get
+        MAINTENANCE_QUERY_TIMEOUT_SECONDS instead, so slow background bulk work neither
+        times out like a request nor opens the breaker for requests.
+
+        Raises:
+            CircuitOpenError: If the breaker is open and this call is not the recovery probe.
+            TimeoutError: If the call took longer than `call_timeout`.
+        """
+        if _in_maintenance.get():
+            async with asyncio.timeout(MAINTENANCE_QUERY_TIMEOUT_SECONDS):
+                yield
+            return
+        is_probe = self._before_call()
+        try:
+            async with asyncio.timeout(self.call_timeout):
+                yield
+        except TimeoutError:
+            db_query_timeouts_total.inc(breaker=self.name)
+            self._record_failure()
+            raise
+        except self.ignored:
+            self._record_success()
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+        else:
+            self._record_success()
+        finally:
+            if is_probe:
+                self.probe_in_flight = False
+
+
+def database_breaker(name: str) -> CircuitBreaker:
+    """
+    Creates a breaker for one database; errors that mean the database answered are ignored.
+    """
+    return CircuitBreaker(
+        name, ignored=(prisma.errors.DataError, prisma.errors.BuilderError)
+    )
+
+
+db_breaker = database_breaker("database")
+
+
+@contextmanager
+def maintenance() -> Iterator[None]:
+    """
+    Marks the database calls made inside as background maintenance for `CircuitBreaker.guard`.
+    """
+    token = _in_maintenance.set(True)
+    try:
+        yield
+    finally:
+        _in_maintenance.reset(token)
+
+
+@asynccontextmanager
+async def maintenance_transaction(
+    client: prisma.Prisma,
+) -> AsyncIterator[prisma.Prisma]:
+    """
+    Runs background bulk work in a transaction on `client` under the maintenance budget.
+
+    The transaction raises the server-side statement_timeout, which connections otherwise
+    set to DB_QUERY_TIMEOUT_SECONDS, to MAINTENANCE_QUERY_TIMEOUT_SECONDS for its statements only.
+    """
+    timeout_ms = int(MAINTENANCE_QUERY_TIMEOUT_SECONDS * 1000)
+    with maintenance():
+        async with client.tx(
+            timeout=timedelta(seconds=MAINTENANCE_QUERY_TIMEOUT_SECONDS)
+        ) as transaction:
+            await transaction.execute_raw(f"SET LOCAL statement_timeout = {timeout_ms}")
+            yield transaction
+
+
+def statement_timeout_url(
+    database_url: str, timeout: float = DB_QUERY_TIMEOUT_SECONDS
+) -> str:
+    """
+    Adds a server-side statement_timeout to a Postgres connection URL.
+
+    A client-side timeout only abandons the request; Postgres keeps running the statement
+    until it finishes unless the server enforces a timeout of its own.
+    """
+    parts = urlsplit(database_url)
+    query = dict(parse_qsl(parts.query))
+    options = query.get("options", "")
+    if "statement_timeout" in options:
+        return database_url
+    query["options"] = f"{options} -c statement_timeout={int(timeout * 1000)}".strip()
+    return urlunsplit(parts._replace(query=urlencode(query, quote_via=quote)))
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import random
+from collections import Counter
+from typing import Dict
+
+import project.redirect_repository
+
+logger = logging.getLogger(__name__)
+
+CLICK_FLUSH_INTERVAL_SECONDS = float(
+    os.environ.get("CLICK_FLUSH_INTERVAL_SECONDS", "5")
+)
+
+CLICK_COUNTER_SLOTS = int(os.environ.get("CLICK_COUNTER_SLOTS", "8"))
+
+CLICK_FOLD_INTERVAL_SECONDS = float(
+    os.environ.get("CLICK_FOLD_INTERVAL_SECONDS", "300")
+)
+
+CLICK_FOLD_IDLE_SECONDS = float(os.environ.get("CLICK_FOLD_IDLE_SECONDS", "600"))
+
+
+class ClickBuffer:
+    """
+    Accumulates redirect clicks in memory and writes them to Analytics in periodic batches.
+
+    Recording a click is a dictionary increment, so redirects never wait on an Analytics write.
+    A flush hands the whole batch to the redirect repository in one call; counts that could
+    not be written are merged back and retried on the next flush. The alias of each URL is
+    kept alongside its count because it decides which shard the clicks go to.
+
+    Each flush writes to one of CLICK_COUNTER_SLOTS counter rows per URL. Workers start at a
+    random slot and advance by one per flush, so concurrent flushes from different workers
+    usually land on different rows instead of queueing on one row lock.
+    """
+
+    def __init__(self, slots: int = CLICK_COUNTER_SLOTS):
+        self.pending: Counter = Counter()
+        self.aliases: Dict[str, str] = {}
+        self.slots = max(slots, 1)
+        self.next_slot = random.randrange(self.slots)
+
+    def record(self, url_id: str, alias: str) -> None:
+        self.pending[url_id] += 1
+        self.aliases[url_id] = alias
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, Counter()
+        aliases, self.aliases = self.aliases, {}
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.slots
+        try:
+            await project.redirect_repository.redirect_repository.increment_clicks(
+                dict(batch), slot, aliases
+            )
+        except project.redirect_repository.ClickFlushError as e:
+            logger.exception("Failed to flush %d click counters", len(e.unapplied))
+            self._requeue(e.unapplied, aliases)
+        except Exception:
+            logger.exception("Failed to flush %d click counters", len(batch))
+            self._requeue(batch, aliases)
+
+    def _requeue(self, counts: Dict[str, int], aliases: Dict[str, str]) -> None:
+        self.pending.update(counts)
+        for url_id in counts:
+            self.aliases.setdefault(url_id, aliases[url_id])
+
+    async def run(self, interval: float = CLICK_FLUSH_INTERVAL_SECONDS) -> None:
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+
+async def run_fold_down(
+    interval: float = CLICK_FOLD_INTERVAL_SECONDS,
+    idle_seconds: float = CLICK_FOLD_IDLE_SECONDS,
+) -> None:
+    """
+    Periodically folds counter slots that have not been written for idle_seconds into slot 0.
+
+    Hot URLs keep their spread of slots while cold ones shrink back to a single row. Running
+    this in several workers at once is safe: each slot row is deleted and summed exactly once.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            folded = (
+                await project.redirect_repository.redirect_repository.fold_click_slots(
+                    idle_seconds
+                )
+            )
+            if folded:
+                logger.info("Folded idle click counter slots for %d URLs", folded)
+        except Exception:
+            logger.exception("Failed to fold click counter slots")
+
+
+click_buffer = ClickBuffer()
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict
+
+import project.metrics
+
+CRITICAL = "critical"
+
+NORMAL = "normal"
+
+SHEDDABLE = "sheddable"
+
+PRIORITIES = (CRITICAL, NORMAL, SHEDDABLE)
+
+# Share of the current limit each class may occupy; lower classes run out of room first.
+CAPACITY_SHARE = {CRITICAL: 1.0, NORMAL: 0.8, SHEDDABLE: 0.6}
+
+# How long a request may queue for a slot before it is shed.
+MAX_QUEUE_WAIT_SECONDS = {CRITICAL: 1.0, NORMAL: 0.25, SHEDDABLE: 0.05}
+
+CONCURRENCY_LIMIT_INITIAL = float(os.environ.get("CONCURRENCY_LIMIT_INITIAL", "50"))
+
+CONCURRENCY_LIMIT_MIN = float(os.environ.get("CONCURRENCY_LIMIT_MIN", "5"))
+
+CONCURRENCY_LIMIT_MAX = float(os.environ.get("CONCURRENCY_LIMIT_MAX", "500"))
+
+CONCURRENCY_LATENCY_TARGET_MS = float(
+    os.environ.get("CONCURRENCY_LATENCY_TARGET_MS", "250")
+)
+
+BACKOFF_RATIO = 0.9
+
+concurrency_limit = project.metrics.Gauge(
+    "concurrency_limit", "Current adaptive concurrency limit."
+)
+
+concurrency_in_flight = project.metrics.Gauge(
+    "concurrency_in_flight", "Requests currently holding a concurrency slot."
+)
+
+concurrency_queue_wait_seconds = project.metrics.Histogram(
+    "concurrency_queue_wait_seconds",
+    "Time requests spent queued for a concurrency slot.",
+    ["priority"],
+)
+
+concurrency_shed_total = project.metrics.Counter(
+    "concurrency_shed_total",
+    "Requests rejected with 503 by the concurrency limiter.",
+    ["priority"],
+)
+
+
+class LoadShedError(Exception):
+    """
+    Raised when a request could not get a concurrency slot within its class's queue budget.
+    """
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit shared by all requests of a worker, with priority classes.
+
+    Each completed request nudges the limit up by 1/limit while latency stays under the
+    target, and a slow or failed one cuts it by BACKOFF_RATIO at most once per target
+    interval. A class may only hold up to its CAPACITY_SHARE of the limit, and freed slots
+    go to queued higher-priority requests first, so redirects keep flowing while analytics,
+    login and register are shed.
+    """
+
+    def __init__(
+        self,
+        initial: float = CONCURRENCY_LIMIT_INITIAL,
+        minimum: float = CONCURRENCY_LIMIT_MIN,
+        maximum: float = CONCURRENCY_LIMIT_MAX,
+        latency_target: float = CONCURRENCY_LATENCY_TARGET_MS / 1000,
+    ):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.waiters: Dict[str, Deque[asyncio.Future]] = {
+            priority: deque() for priority in PRIORITIES
+        }
+        concurrency_limit.set(self.limit)
+
+    def _capacity(self, priority: str) -> int:
+        return max(1, int(self.limit * CAPACITY_SHARE[priority]))
+
+    def _has_waiters_at_or_above(self, priority: str) -> bool:
+        for level in PRIORITIES:
+            if any(not waiter.done() for waiter in self.waiters[level]):
+                return True
+            if level == priority:
+                return False
+        return False
+
+    def _take_slot(self) -> None:
+        self.in_flight += 1
+        concurrency_in_flight.set(self.in_flight)
+
+    def _wake(self) -> None:
+        for priority in PRIORITIES:
+            queue = self.waiters[priority]
+            while queue and self.in_flight < self._capacity(priority):
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                self._take_slot()
+                waiter.set_result(None)
+
+    async def acquire(self, priority: str) -> None:
+        """
+        Takes a concurrency slot, queueing for up to the class's MAX_QUEUE_WAIT_SECONDS.
+
+        Raises:
+            LoadShedError: If no slot became free in time.
+        """
+        started = time.perf_counter()
+        if self.in_flight < self._capacity(
+            priority
+        ) and not self._has_waiters_at_or_above(priority):
+            self._take_slot()
+            concurrency_queue_wait_seconds.observe(0.0, priority=priority)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[priority].append(waiter)
+        try:
+            async with asyncio.timeout(MAX_QUEUE_WAIT_SECONDS[priority]):
+                await waiter
+        except TimeoutError:
+            if not waiter.done() or waiter.cancelled():
+                concurrency_shed_total.inc(priority=priority)
+                raise LoadShedError(f"Shedding {priority} request under load")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        concurrency_queue_wait_seconds.observe(
+            time.perf_counter() - started, priority=priority
+        )
+
+    def release(self, latency: float, succeeded: bool) -> None:
+        """
+        Frees a slot and adapts the limit to the request's latency and outcome.
+        """
+        now = time.monotonic()
+        if latency > self.latency_target or not succeeded:
+            if now - self.last_decrease >= self.latency_target:
+                self.limit = max(self.minimum, self.limit * BACKOFF_RATIO)
+                self.last_decrease = now
+        elif self.in_flight >= self.limit / 2:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        concurrency_limit.set(self.limit)
+        self.in_flight -= 1
+        concurrency_in_flight.set(self.in_flight)
+        self._wake()
+
+
+def classify_request(method: str, path: str) -> str | None:
+    """
+    Maps a request to its priority class, or None for operational endpoints that are never limited.
+    """
+    if path == "/metrics" or path.startswith("/admin/"):
+        return None
+    if method == "GET" and path.startswith("/url/"):
+        return CRITICAL
+    if (
+        path.startswith("/analytics/")
+        or path.startswith("/api/analytics/")
+        or path in ("/auth/register", "/auth/login")
+    ):
+        return SHEDDABLE
+    return NORMAL
+
+
+concurrency_limiter = AdaptiveConcurrencyLimiter()
@@ -1,9 +1,31 @@
-from datetime import datetime
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
 
-import prisma
-import prisma.models
+import project.click_counter
+import project.http_caching
+import project.metrics
+import project.redirect_repository
+import project.redirect_table
 from pydantic import BaseModel
 
+REDIRECT_CACHE_MAX_AGE_SECONDS = int(
+    os.environ.get("REDIRECT_CACHE_MAX_AGE_SECONDS", "300")
+)
+
+REDIRECT_MAX_STALENESS_SECONDS = float(
+    os.environ.get("REDIRECT_MAX_STALENESS_SECONDS", "3600")
+)
+
+REDIRECT_STALE_CACHE_SIZE = int(os.environ.get("REDIRECT_STALE_CACHE_SIZE", "10000"))
+
+redirect_stale_serves_total = project.metrics.Counter(
+    "redirect_stale_serves_total",
+    "Redirects served from the last known mapping because the database lookup failed.",
+)
+
 
 class GetOriginalUrlResponse(BaseModel):
     """
@@ -15,6 +37,132 @@ class GetOriginalUrlResponse(BaseModel):
     expiration_status: str
 
 
+class LastKnownMappings:
+    """
+    Bounded LRU of the most recent mapping the database returned for each alias.
+
+    Used only when a lookup fails, such as while the database circuit breaker is open,
+    and never for mappings older than REDIRECT_MAX_STALENESS_SECONDS.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = REDIRECT_STALE_CACHE_SIZE,
+        max_staleness: float = REDIRECT_MAX_STALENESS_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.max_staleness = max_staleness
+        self.entries: OrderedDict = OrderedDict()
+
+    def put(
+        self, alias: str, url_entry: Optional[project.redirect_repository.UrlMapping]
+    ) -> None:
+        if url_entry is None:
+            self.entries.pop(alias, None)
+            return
+        self.entries[alias] = (url_entry, time.monotonic())
+        self.entries.move_to_end(alias)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, alias: str) -> Optional[project.redirect_repository.UrlMapping]:
+        entry = self.entries.get(alias)
+        if entry is None:
+            return None
+        url_entry, stored_at = entry
+        if time.monotonic() - stored_at > self.max_staleness:
+            del self.entries[alias]
+            return None
+        return url_entry
+
+
+last_known_mappings = LastKnownMappings()
+
+
+async def resolve_original_url(
+    alias: str,
+) -> Tuple[Optional[project.redirect_repository.UrlMapping], str, bool]:
+    """
+    Looks up the mapping for an alias and records a click if it is active.
+
+    If the database lookup fails, the last mapping seen for the alias is served instead
+    as long as it is within REDIRECT_MAX_STALENESS_SECONDS; otherwise the error propagates.
+
+    Args:
+        alias (str): The unique alias for the shortened URL.
+
+    Returns:
+        Tuple[Optional[UrlMapping], str, bool]: The mapping, if any, its expiration status,
+        and whether it is a last known mapping served because the lookup failed.
+    """
+    url_entry = None
+    stale = False
+    if project.redirect_table.redirect_table is not None:
+        url_entry = project.redirect_table.redirect_table.lookup(alias)
+    if url_entry is None:
+        try:
+            url_entry = (
+                await project.redirect_repository.redirect_repository.find_by_alias(
+                    alias
+                )
+            )
+        except Exception:
+            url_entry = last_known_mappings.get(alias)
+            if url_entry is None:
+                raise
+            redirect_stale_serves_total.inc()
+            stale = True
+        else:
+            last_known_mappings.put(alias, url_entry)
+    if not url_entry:
+        return None, "not found or expired", stale
+    if url_entry.expiresAt and url_entry.expiresAt < datetime.now(timezone.utc):
+        return url_entry, "expired", stale
+    project.click_counter.click_buffer.record(url_entry.id, url_entry.alias or alias)
+    return url_entry, "active", stale
+
+
+def original_url_cache_headers(
+    url_entry: Optional[project.redirect_repository.UrlMapping],
+    expiration_status: str,
+    stale: bool = False,
+) -> Dict[str, str]:
+    """
+    Derives the validators and freshness lifetime of a redirect from its Url row.
+
+    Active links are cacheable for REDIRECT_CACHE_MAX_AGE_SECONDS, but never past their expiry.
+    Stale serves are not cacheable, so shared caches do not keep a mapping the database
+    could not confirm.
+    """
+    if url_entry is None or expiration_status != "active" or stale:
+        return {"Cache-Control": "no-cache"}
+    max_age = project.http_caching.seconds_until(
+        url_entry.expiresAt, REDIRECT_CACHE_MAX_AGE_SECONDS
+    )
+    return project.http_caching.cache_headers(
+        project.http_caching.make_etag(
+            url_entry.id, url_entry.updatedAt, url_entry.expiresAt, expiration_status
+        ),
+        url_entry.updatedAt,
+        f"public, max-age={max_age}",
+    )
+
+
+def build_original_url_response(
+    url_entry: Optional[project.redirect_repository.UrlMapping],
+    expiration_status: str,
+) -> GetOriginalUrlResponse:
+    if url_entry is None:
+        return GetOriginalUrlResponse(
+            originalUrl="", alias="", expiration_status=expiration_status
+        )
+    return GetOriginalUrlResponse(
+        originalUrl=url_entry.originalUrl,
+        alias=url_entry.alias if url_entry.alias else "",
+        expiration_status=expiration_status,
+    )
+
+
 async def get_original_url(alias: str) -> GetOriginalUrlResponse:
     """
     Retrieves the original URL based on a shortened alias.
@@ -32,17 +180,5 @@ async def get_original_url(alias: str) -> GetOriginalUrlResponse:
         else:
             print('URL not found or has expired')
     """
-    url_entry = await prisma.models.Url.prisma().find_unique(where={"alias": alias})
-    if url_entry:
-        if url_entry.expiresAt and url_entry.expiresAt < datetime.now():
-            expiration_status = "expired"
-        else:
-            expiration_status = "active"
-        return GetOriginalUrlResponse(
-            originalUrl=url_entry.originalUrl,
-            alias=url_entry.alias if url_entry.alias else "",
-            expiration_status=expiration_status,
-        )
-    return GetOriginalUrlResponse(
-        originalUrl="", alias="", expiration_status="not found or expired"
-    )
+    url_entry, expiration_status, _ = await resolve_original_url(alias)
+    return build_original_url_response(url_entry, expiration_status)
@@ -1,10 +1,18 @@
+import os
 from datetime import datetime
 from typing import Any, Dict, List
 
 import prisma
 import prisma.models
+import project.analytics_partitions
+import project.http_caching
+import project.sharding
 from pydantic import BaseModel
 
+ANALYTICS_CACHE_MAX_AGE_SECONDS = int(
+    os.environ.get("ANALYTICS_CACHE_MAX_AGE_SECONDS", "5")
+)
+
 
 class GetUrlAnalyticsResponse(BaseModel):
     """
@@ -19,22 +27,46 @@ class GetUrlAnalyticsResponse(BaseModel):
     geographicalData: Dict[str, int]
 
 
-async def get_url_analytics(urlId: str) -> GetUrlAnalyticsResponse:
+async def load_url_analytics(urlId: str) -> List[prisma.models.Analytics]:
     """
-    Fetch analytics data for a specific URL.
+    Fetches every click counter slot recorded for a URL within the retention window.
 
-    Args:
-    urlId (str): The unique identifier for the URL whose analytics data is to be fetched.
+    Bounding the bucket lets Postgres prune the query to the retained monthly partitions.
+    """
+    client = await project.sharding.find_client_for_url_id(urlId)
+    if client is None:
+        return []
+    start, end = project.analytics_partitions.retention_window()
+    return await client.analytics.find_many(
+        where={"urlId": urlId, "bucket": {"gte": start, "lt": end}}
+    )
 
-    Returns:
-    GetUrlAnalyticsResponse: This response model contains the analytics data for the specific URL. It provides a summary
-                             of the click-through rates and other relevant metrics, while ensuring that the data is presented
-                             in an anonymized manner to protect user privacy.
+
+def url_analytics_cache_headers(
+    urlId: str, analytics_slots: List[prisma.models.Analytics]
+) -> Dict[str, str]:
     """
-    analytics_data = await prisma.models.Analytics.prisma().find_unique(
-        where={"urlId": urlId}, include={"Url": True}
+    Derives the validators of an analytics response from its counter slots' updatedAt.
+    """
+    if not analytics_slots:
+        return {"Cache-Control": "no-cache"}
+    updated_at = max((analytics.updatedAt for analytics in analytics_slots))
+    return project.http_caching.cache_headers(
+        project.http_caching.make_etag(
+            urlId,
+            len(analytics_slots),
+            sum((analytics.clicks for analytics in analytics_slots)),
+            updated_at,
+        ),
+        updated_at,
+        f"public, max-age={ANALYTICS_CACHE_MAX_AGE_SECONDS}",
     )
-    if analytics_data is None:
+
+
+def build_url_analytics_response(
+    urlId: str, analytics_slots: List[prisma.models.Analytics]
+) -> GetUrlAnalyticsResponse:
+    if not analytics_slots:
         return GetUrlAnalyticsResponse(
             urlId=urlId,
             clicks=0,
@@ -46,10 +78,25 @@ async def get_url_analytics(urlId: str) -> GetUrlAnalyticsResponse:
     top_referrers = [{"google.com": 100}, {"yahoo.com": 50}]
     geographical_data = {"US": 100, "UK": 50}
     return GetUrlAnalyticsResponse(
-        urlId=analytics_data.urlId,
-        clicks=analytics_data.clicks,
-        createdAt=analytics_data.createdAt,
-        updatedAt=analytics_data.updatedAt,
+        urlId=urlId,
+        clicks=sum((analytics.clicks for analytics in analytics_slots)),
+        createdAt=min((analytics.createdAt for analytics in analytics_slots)),
+        updatedAt=max((analytics.updatedAt for analytics in analytics_slots)),
         topReferrers=top_referrers,
         geographicalData=geographical_data,
     )
+
+
+async def get_url_analytics(urlId: str) -> GetUrlAnalyticsResponse:
+    """
+    Fetch analytics data for a specific URL.
+
+    Args:
+    urlId (str): The unique identifier for the URL whose analytics data is to be fetched.
+
+    Returns:
+    GetUrlAnalyticsResponse: This response model contains the analytics data for the specific URL. It provides a summary
+                             of the click-through rates and other relevant metrics, while ensuring that the data is presented
+                             in an anonymized manner to protect user privacy.
+    """
+    return build_url_analytics_response(urlId, await load_url_analytics(urlId))
@@ -0,0 +1,76 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+
+def make_etag(*parts: object) -> str:
+    """
+    Builds a strong entity tag from the values the response body is derived from.
+    """
+    digest = hashlib.blake2b(
+        "\x1f".join(str(part) for part in parts).encode(), digest_size=12
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def seconds_until(value: Optional[datetime], ceiling: int) -> int:
+    """
+    Returns a max-age that never reaches past `value`, capped at `ceiling` seconds.
+    """
+    if value is None:
+        return ceiling
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    remaining = int((value - datetime.now(timezone.utc)).total_seconds())
+    return max(0, min(ceiling, remaining))
+
+
+def is_not_modified(
+    request_headers: Mapping[str, str], response_headers: Mapping[str, str]
+) -> bool:
+    """
+    Evaluates If-None-Match, or If-Modified-Since when no entity tags were sent, as described in RFC 9110.
+
+    Args:
+        request_headers (Mapping[str, str]): The request headers.
+        response_headers (Mapping[str, str]): The cache headers the full response would carry.
+
+    Returns:
+        bool: True if the client's cached copy is current and a 304 can be sent.
+    """
+    etag = response_headers.get("ETag")
+    if etag is None:
+        return False
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or any(
+            tag.removeprefix("W/") == etag for tag in candidates
+        )
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = response_headers.get("Last-Modified")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(
+            if_modified_since
+        )
+    except (TypeError, ValueError):
+        return False
+
+
+def cache_headers(
+    etag: str, last_modified: datetime, cache_control: str
+) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": cache_control,
+    }
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+import prisma
+import project.circuit_breaker
+import project.metrics
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "30"))
+
+IDEMPOTENCY_POLL_SECONDS = 0.05
+
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = 3600.0
+
+M = TypeVar("M", bound=BaseModel)
+
+# Inserts a pending claim on the key, or takes over one whose result or lease expired.
+# Returns no row while another request holds the key.
+CLAIM_KEY_SQL = """
+INSERT INTO "IdempotencyKey" (operation, "key", fingerprint, claim, "expiresAt")
+VALUES ($1, $2, $3, $4, now() + make_interval(secs => $5))
+ON CONFLICT (operation, "key") DO UPDATE
+SET fingerprint = EXCLUDED.fingerprint,
+    claim = EXCLUDED.claim,
+    response = NULL,
+    "expiresAt" = EXCLUDED."expiresAt"
+WHERE "IdempotencyKey"."expiresAt" < now()
+RETURNING claim
+"""
+
+FIND_KEY_SQL = """
+SELECT fingerprint, response
+FROM "IdempotencyKey"
+WHERE operation = $1 AND "key" = $2 AND "expiresAt" >= now()
+"""
+
+STORE_RESPONSE_SQL = """
+UPDATE "IdempotencyKey"
+SET response = $4, "expiresAt" = now() + make_interval(secs => $5)
+WHERE operation = $1 AND "key" = $2 AND claim = $3
+"""
+
+RELEASE_KEY_SQL = """
+DELETE FROM "IdempotencyKey"
+WHERE operation = $1 AND "key" = $2 AND claim = $3 AND response IS NULL
+"""
+
+PURGE_EXPIRED_KEYS_SQL = 'DELETE FROM "IdempotencyKey" WHERE "expiresAt" < now()'
+
+idempotent_replays_total = project.metrics.Counter(
+    "idempotent_replays_total",
+    "Requests answered from a stored or in-flight result for the same Idempotency-Key.",
+    ["operation"],
+)
+
+
+class IdempotencyKeyReusedError(ValueError):
+    """
+    Raised when an Idempotency-Key is sent again with different request parameters.
+    """
+
+
+class IdempotencyKeyInProgressError(Exception):
+    """
+    Raised when another worker is still handling a request with the same Idempotency-Key.
+    """
+
+
+def _fingerprint(parameters: Hashable) -> str:
+    return json.dumps(parameters, sort_keys=True, default=str)
+
+
+class IdempotencyStore:
+    """
+    Map from (operation, Idempotency-Key) to the result of the first request that used it, kept
+    in the "IdempotencyKey" table so every worker sees it.
+
+    The first request claims the key with a pending row before doing any work and stores its
+    response once done; retries on any worker replay that response without calling the
+    service. A claim is only honoured for IDEMPOTENCY_LEASE_SECONDS, so a worker that died
+    mid-request does not block the key for the whole TTL. Failed requests release their claim
+    so the client can retry them. Within a worker, concurrent duplicates also share one
+    in-process future and so issue no queries of their own.
+    """
+
+    def __init__(
+        self,
+        ttl: float = IDEMPOTENCY_TTL_SECONDS,
+        lease: float = IDEMPOTENCY_LEASE_SECONDS,
+        poll_interval: float = IDEMPOTENCY_POLL_SECONDS,
+        client: Optional[prisma.Prisma] = None,
+    ):
+        self.ttl = ttl
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.client = client
+        self.in_flight: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+
+    def _client(self) -> prisma.Prisma:
+        return self.client or prisma.get_client()
+
+    async def run(
+        self,
+        operation: str,
+        key: Optional[str],
+        fingerprint: Hashable,
+        call: Callable[[], Awaitable[M]],
+        response_model: Type[M],
+    ) -> M:
+        """
+        Runs `call` once per (operation, key) and hands its result to every request with the same key.
+
+        Args:
+            operation (str): Name of the endpoint, so keys from different endpoints never collide.
+            key (Optional[str]): The client's Idempotency-Key header; when None `call` simply runs.
+            fingerprint (Hashable): The request parameters, which every reuse of the key must match.
+            call (Callable[[], Awaitable[M]]): Performs the request.
+            response_model (Type[M]): The model `call` returns, used to decode stored results.
+
+        Returns:
+            M: The result of the first request made with this key.
+
+        Raises:
+            IdempotencyKeyReusedError: If the key was already used with a different fingerprint.
+            IdempotencyKeyInProgressError: If another worker held the key for the whole lease.
+        """
+        if key is None:
+            return await call()
+        store_key = (operation, key)
+        encoded = _fingerprint(fingerprint)
+        in_flight = self.in_flight.get(store_key)
+        if in_flight is not None:
+            if in_flight[0] != encoded:
+                raise IdempotencyKeyReusedError(
+                    "Idempotency-Key was already used with different parameters"
+                )
+            idempotent_replays_total.inc(operation=operation)
+            return await asyncio.shield(in_flight[1])
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.in_flight[store_key] = (encoded, future)
+        try:
+            result = await self._run_once(operation, key, encoded, call, response_model)
+        except BaseException as e:
+            future.set_exception(
+                e
+                if isinstance(e, Exception)
+                else RuntimeError("The original request was cancelled")
+            )
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.in_flight[store_key]
+
+    async def _run_once(
+        self,
+        operation: str,
+        key: str,
+        fingerprint: str,
+        call: Callable[[], Awaitable[M]],
+        response_model: Type[M],
+    ) -> M:
+        client = self._client()
+        claim = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lease
+        while not await client.query_raw(
+            CLAIM_KEY_SQL, operation, key, fingerprint, claim, self.lease
+        ):
+            rows = await client.query_raw(FIND_KEY_SQL, operation, key)
+            if rows:
+                if rows[0]["fingerprint"] != fingerprint:
+                    raise IdempotencyKeyReusedError(
+                        "Idempotency-Key was already used with different parameters"
+                    )
+                if rows[0]["response"] is not None:
+                    idempotent_replays_total.inc(operation=operation)
+                    return response_model.parse_raw(rows[0]["response"])
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInProgressError(
+                    "A request with this Idempotency-Key is still being processed"
+                )
+            await asyncio.sleep(self.poll_interval)
+        try:
+            result = await call()
+        except BaseException:
+            try:
+                await client.execute_raw(RELEASE_KEY_SQL, operation, key, claim)
+            except Exception:
+                logger.exception("Failed to release Idempotency-Key for %s", operation)
+            raise
+        try:
+            await client.execute_raw(
+                STORE_RESPONSE_SQL, operation, key, claim, result.json(), self.ttl
+            )
+        except Exception:
+            logger.exception("Failed to store Idempotency-Key result for %s", operation)
+        return result
+
+    async def purge_expired(self) -> int:
+        async with project.circuit_breaker.maintenance_transaction(
+            self._client()
+        ) as transaction:
+            return await transaction.execute_raw(PURGE_EXPIRED_KEYS_SQL)
+
+
+async def run_purges(
+    store: IdempotencyStore, interval: float = IDEMPOTENCY_PURGE_INTERVAL_SECONDS
+) -> None:
+    """
+    Periodically deletes expired keys; claims on them would take them over anyway, so this only bounds the table.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            purged = await store.purge_expired()
+            if purged:
+                logger.info("Purged %d expired idempotency keys", purged)
+        except Exception:
+            logger.exception("Failed to purge expired idempotency keys")
+
+
+idempotency_store = IdempotencyStore()
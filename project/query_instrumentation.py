@@ -0,0 +1,164 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional, Set, Tuple
+
+import project.circuit_breaker
+import project.metrics
+from prisma import Prisma
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", "5"))
+
+db_queries_total = project.metrics.Counter(
+    "db_queries_total", "Prisma queries issued.", ["model", "action"]
+)
+
+db_query_duration_seconds = project.metrics.Histogram(
+    "db_query_duration_seconds",
+    "Time spent waiting on the Prisma query engine.",
+    ["model", "action"],
+)
+
+db_slow_queries_total = project.metrics.Counter(
+    "db_slow_queries_total",
+    "Prisma queries slower than SLOW_QUERY_MS.",
+    ["model", "action"],
+)
+
+db_n_plus_one_total = project.metrics.Counter(
+    "db_n_plus_one_total",
+    "Requests that repeated the same model/action at least N_PLUS_ONE_THRESHOLD times.",
+    ["model", "action"],
+)
+
+
+class QueryStats:
+    """
+    Per-request tally of the queries issued through InstrumentedPrisma.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.by_operation: Counter = Counter()
+        self.flagged: Set[Tuple[str, str]] = set()
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "query_stats", default=None
+)
+
+
+@contextmanager
+def collect_query_stats() -> Iterator[QueryStats]:
+    """
+    Collects statistics for every query issued within the block, including from tasks spawned inside it.
+    """
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def record_query(model: str, action: str, elapsed: float) -> None:
+    """
+    Records a finished query in the metrics, the slow-query log and the current request's stats.
+
+    Args:
+        model (str): The Prisma model the query ran against, or "raw" for raw SQL.
+        action (str): The Prisma action, such as find_unique or update.
+        elapsed (float): Wall-clock time the query took, in seconds.
+    """
+    elapsed_ms = elapsed * 1000
+    db_queries_total.inc(model=model, action=action)
+    db_query_duration_seconds.observe(elapsed, model=model, action=action)
+    if elapsed_ms >= SLOW_QUERY_MS:
+        db_slow_queries_total.inc(model=model, action=action)
+        logger.warning("Slow query %s.%s took %.1fms", model, action, elapsed_ms)
+    stats = _current_stats.get()
+    if stats is None:
+        return
+    stats.count += 1
+    stats.total_ms += elapsed_ms
+    operation = (model, action)
+    stats.by_operation[operation] += 1
+    if (
+        stats.by_operation[operation] >= N_PLUS_ONE_THRESHOLD
+        and operation not in stats.flagged
+    ):
+        stats.flagged.add(operation)
+        db_n_plus_one_total.inc(model=model, action=action)
+        logger.warning(
+            "Possible N+1: %s.%s issued %d times in one request",
+            model,
+            action,
+            stats.by_operation[operation],
+        )
+
+
+class InstrumentedPrisma(Prisma):
+    """
+    Prisma client that times every query sent to the query engine.
+
+    All generated model actions and raw queries funnel through `_execute`, so overriding it
+    covers the whole client without touching the services. Every query also runs under the
+    client's circuit breaker (the shared database breaker unless one is given) and its
+    per-query timeout, which `connect` also sets as the server-side statement_timeout so
+    Postgres stops statements the client gave up on.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        breaker: Optional[project.circuit_breaker.CircuitBreaker] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker or project.circuit_breaker.db_breaker
+
+    def _copy(self) -> "InstrumentedPrisma":
+        # Transactions run on a copy of the client, which must keep its breaker.
+        copy = super()._copy()
+        copy.breaker = self.breaker
+        return copy
+
+    async def connect(self, *args: Any, **kwargs: Any) -> None:
+        datasource = self._datasource or {"url": self._default_datasource["url"]}
+        self._datasource = {
+            **datasource,
+            "url": project.circuit_breaker.statement_timeout_url(datasource["url"]),
+        }
+        await super().connect(*args, **kwargs)
+
+    async def _execute(
+        self,
+        *,
+        method: Any,
+        arguments: dict,
+        model: Any = None,
+        root_selection: Any = None,
+    ) -> Any:
+        async with self.breaker.guard():
+            started = time.perf_counter()
+            try:
+                return await super()._execute(
+                    method=method,
+                    arguments=arguments,
+                    model=model,
+                    root_selection=root_selection,
+                )
+            finally:
+                record_query(
+                    model.__name__ if model is not None else "raw",
+                    str(method),
+                    time.perf_counter() - started,
+                )
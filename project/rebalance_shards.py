@@ -0,0 +1,143 @@
+"""
+Moves Url rows and their Analytics to the shard that owns them under the current ring.
+
+After adding a shard to URL_SHARD_DATABASE_URLS, run this with URL_SHARD_PREVIOUS_NAMES
+set to the old shard names so redirects keep finding rows that have not moved yet. Only
+rows whose owner changed, roughly 1/N of them, are copied, and they keep their id. Each row
+is created on its new shard before it is deleted from the old one, so it stays reachable
+throughout. Once the run finishes, unset URL_SHARD_PREVIOUS_NAMES. Re-running is safe,
+including after a move that failed halfway:
+
+    python -m project.rebalance_shards --dry-run
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+from datetime import timedelta
+
+import prisma
+import prisma.models
+import project.circuit_breaker
+import project.redirect_repository
+import project.sharding
+
+PAGE_SIZE = 500
+
+MOVE_TIMEOUT = timedelta(seconds=60)
+
+# Taken before deleting the source row: concurrent click flushes need a key-share lock on
+# the Url row for their foreign key check, so they wait and then fail instead of writing
+# clicks that the delete below would discard. The flusher retries them on the new shard.
+LOCK_URL_SQL = 'SELECT id FROM "Url" WHERE id = $1 FOR UPDATE'
+
+TAKE_ANALYTICS_SQL = """
+DELETE FROM "Analytics"
+WHERE "urlId" = $1
+RETURNING bucket::text AS bucket, slot, clicks, "userId"
+"""
+
+# Moved clicks are summed per month into their own slot, which they replace rather than add
+# to. If the source transaction fails to commit after this ran, the re-run writes the same
+# totals again instead of counting them twice. Clicks flushed to the target meanwhile land
+# in the ordinary slots and are left alone.
+MERGE_ANALYTICS_SQL = f"""
+INSERT INTO "Analytics" ("urlId", bucket, slot, clicks, "updatedAt", "userId")
+SELECT $1, bucket, {project.redirect_repository.MOVED_CLICKS_SLOT}, sum(clicks)::int,
+    now(), max(user_id)
+FROM unnest($2::date[], $3::int[], $4::text[]) AS moved(bucket, clicks, user_id)
+GROUP BY bucket
+ON CONFLICT ("urlId", bucket, slot) DO UPDATE
+SET clicks = EXCLUDED.clicks, "updatedAt" = EXCLUDED."updatedAt"
+"""
+
+
+async def move_url(
+    source: prisma.Prisma, target: prisma.Prisma, url: prisma.models.Url
+) -> None:
+    fields = {
+        "originalUrl": url.originalUrl,
+        "shortUrl": url.shortUrl,
+        "alias": url.alias,
+        "expiresAt": url.expiresAt,
+        "userId": url.userId,
+    }
+    await target.url.upsert(
+        where={"id": url.id},
+        data={
+            "create": {"id": url.id, "createdAt": url.createdAt, **fields},
+            "update": fields,
+        },
+    )
+    # The source transaction stays open until the analytics are merged into the target, so
+    # a failure rolls the source back and a re-run finds the row and its clicks where they
+    # were; MERGE_ANALYTICS_SQL then overwrites whatever the failed attempt merged.
+    async with source.tx(timeout=MOVE_TIMEOUT) as transaction:
+        await transaction.query_raw(LOCK_URL_SQL, url.id)
+        rows = await transaction.query_raw(TAKE_ANALYTICS_SQL, url.id)
+        await transaction.url.delete(where={"id": url.id})
+        if rows:
+            await target.execute_raw(
+                MERGE_ANALYTICS_SQL,
+                url.id,
+                [row["bucket"] for row in rows],
+                [row["clicks"] for row in rows],
+                [row["userId"] for row in rows],
+            )
+
+
+async def rebalance(
+    router: project.sharding.ShardRouter, dry_run: bool
+) -> Counter:
+    """
+    Walks every shard and moves the Url rows whose alias is owned by another shard.
+
+    Returns:
+        Counter: The number of rows per (source, target) shard pair.
+    """
+    moves: Counter = Counter()
+    for source_name, source in router.clients.items():
+        last_id = ""
+        while True:
+            page = await source.url.find_many(
+                where={"id": {"gt": last_id}}, take=PAGE_SIZE, order={"id": "asc"}
+            )
+            for url in page:
+                if url.alias is None:
+                    continue
+                target_name = router.shard_for_alias(url.alias)
+                if target_name == source_name:
+                    continue
+                moves[(source_name, target_name)] += 1
+                if not dry_run:
+                    await move_url(source, router.clients[target_name], url)
+            if len(page) < PAGE_SIZE:
+                break
+            last_id = page[-1].id
+    return moves
+
+
+async def main(args: argparse.Namespace) -> None:
+    router = project.sharding.shard_router
+    if router is None:
+        raise SystemExit("URL_SHARD_DATABASE_URLS is not set")
+    await router.connect()
+    try:
+        with project.circuit_breaker.maintenance():
+            moves = await rebalance(router, args.dry_run)
+    finally:
+        await router.disconnect()
+    for (source_name, target_name), count in sorted(moves.items()):
+        print(f"{source_name} -> {target_name}: {count} URLs to move")
+    if not moves:
+        print("Every URL is on its owning shard")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only report how many rows would move.",
+    )
+    asyncio.run(main(parser.parse_args()))
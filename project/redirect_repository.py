@@ -0,0 +1,345 @@
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import prisma
+import project.analytics_partitions
+import project.circuit_breaker
+import project.query_instrumentation
+import project.sharding
+from pydantic import BaseModel
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+FIND_BY_ALIAS_SQL = """
+SELECT id, "originalUrl", alias, "expiresAt", "updatedAt"
+FROM "Url"
+WHERE alias = $1
+"""
+
+# Holds the clicks project.rebalance_shards carried over from a URL's previous shard. Click
+# flushes use slots 0 and up, and folding leaves this slot alone.
+MOVED_CLICKS_SLOT = -1
+
+INCREMENT_CLICKS_SQL = """
+INSERT INTO "Analytics" ("urlId", bucket, slot, clicks, "updatedAt")
+SELECT url_id, $4::date, $3::int, clicks, now()
+FROM unnest($1::text[], $2::int[]) AS batch(url_id, clicks)
+WHERE EXISTS (SELECT 1 FROM "Url" WHERE "Url".id = batch.url_id)
+ON CONFLICT ("urlId", bucket, slot) DO UPDATE
+SET clicks = "Analytics".clicks + EXCLUDED.clicks, "updatedAt" = EXCLUDED."updatedAt"
+RETURNING "urlId"
+"""
+
+FOLD_CLICK_SLOTS_SQL = """
+WITH folded AS (
+    DELETE FROM "Analytics"
+    WHERE slot > 0
+      AND bucket >= $2::date
+      AND "updatedAt" < now() - make_interval(secs => $1)
+    RETURNING "urlId", bucket, clicks
+)
+INSERT INTO "Analytics" ("urlId", bucket, slot, clicks, "updatedAt")
+SELECT "urlId", bucket, 0, sum(clicks)::int, now()
+FROM folded
+GROUP BY "urlId", bucket
+ON CONFLICT ("urlId", bucket, slot) DO UPDATE
+SET clicks = "Analytics".clicks + EXCLUDED.clicks, "updatedAt" = EXCLUDED."updatedAt"
+"""
+
+
+def _fold_window_start() -> datetime:
+    """
+    Returns the oldest bucket folding looks at; earlier months went idle and were folded long ago.
+    """
+    return project.analytics_partitions.add_months(
+        project.analytics_partitions.month_bucket(), -1
+    )
+
+
+class ClickFlushError(Exception):
+    """
+    Raised when part of a click batch could not be written; `unapplied` holds the counts that were not.
+    """
+
+    def __init__(self, unapplied: Dict[str, int]):
+        super().__init__(f"Failed to write clicks for {len(unapplied)} URLs")
+        self.unapplied = unapplied
+
+
+class UrlMapping(BaseModel):
+    """
+    The fields of a Url row needed to serve a redirect.
+    """
+
+    id: str
+    originalUrl: str
+    alias: Optional[str] = None
+    expiresAt: Optional[datetime] = None
+    updatedAt: datetime
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
+
+
+class PrismaRedirectRepository:
+    """
+    Serves redirect lookups and click updates through Prisma, on the owning shard when sharding is enabled.
+
+    A click batch is applied with one INCREMENT_CLICKS_SQL statement per database, so each
+    database takes its part of the batch or none of it. When some databases fail, the others'
+    parts stay applied and ClickFlushError reports only the failed parts for retrying.
+    """
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def find_by_alias(self, alias: str) -> Optional[UrlMapping]:
+        url_entry = await project.sharding.find_url_by_alias(alias)
+        if url_entry is None:
+            return None
+        return UrlMapping(
+            id=url_entry.id,
+            originalUrl=url_entry.originalUrl,
+            alias=url_entry.alias,
+            expiresAt=_as_utc(url_entry.expiresAt),
+            updatedAt=_as_utc(url_entry.updatedAt),
+        )
+
+    async def increment_clicks(
+        self, counts: Dict[str, int], slot: int, aliases: Dict[str, str]
+    ) -> None:
+        """
+        Adds a batch of clicks to one counter slot of the current month.
+
+        Each URL's clicks go to the shard owning its alias. While shards are rebalanced, URLs
+        not found there are retried on their previous shard; clicks for URLs found nowhere,
+        because they were deleted, are dropped.
+
+        Raises:
+            ClickFlushError: If a database failed; the clicks applied elsewhere are not repeated.
+        """
+        bucket = project.analytics_partitions.month_bucket()
+        missing, unapplied, error = await _apply_clicks(
+            counts,
+            slot,
+            bucket,
+            lambda url_id: project.sharding.client_for_alias(aliases[url_id]),
+        )
+        retry = {
+            url_id: counts[url_id]
+            for url_id in missing
+            if project.sharding.previous_client_for_alias(aliases[url_id]) is not None
+        }
+        if retry:
+            still_missing, retry_unapplied, retry_error = await _apply_clicks(
+                retry,
+                slot,
+                bucket,
+                lambda url_id: project.sharding.previous_client_for_alias(
+                    aliases[url_id]
+                ),
+            )
+            missing = (missing - retry.keys()) | still_missing
+            unapplied.update(retry_unapplied)
+            error = error or retry_error
+        if missing:
+            logger.warning("Dropping clicks for %d deleted URLs", len(missing))
+        if unapplied:
+            raise ClickFlushError(unapplied) from error
+
+    async def fold_click_slots(self, idle_seconds: float) -> int:
+        folded = 0
+        since = _fold_window_start()
+        for client in project.sharding.database_clients():
+            async with project.circuit_breaker.maintenance_transaction(
+                client
+            ) as transaction:
+                folded += await transaction.execute_raw(
+                    FOLD_CLICK_SLOTS_SQL, idle_seconds, since
+                )
+        return folded
+
+
+async def _apply_clicks(
+    counts: Dict[str, int],
+    slot: int,
+    bucket: datetime,
+    client_for: Callable[[str], prisma.Prisma],
+) -> Tuple[Set[str], Dict[str, int], Optional[Exception]]:
+    """
+    Runs INCREMENT_CLICKS_SQL once per database.
+
+    Returns:
+        Tuple[Set[str], Dict[str, int], Optional[Exception]]: The URL ids whose database has
+        no such Url, the counts of databases that failed, and the first failure.
+    """
+    batches: Dict[prisma.Prisma, Dict[str, int]] = {}
+    for url_id, clicks in counts.items():
+        batches.setdefault(client_for(url_id), {})[url_id] = clicks
+    missing: Set[str] = set()
+    unapplied: Dict[str, int] = {}
+    error: Optional[Exception] = None
+    for client, batch in batches.items():
+        try:
+            rows = await client.query_raw(
+                INCREMENT_CLICKS_SQL,
+                list(batch.keys()),
+                list(batch.values()),
+                slot,
+                bucket,
+            )
+        except Exception as e:
+            unapplied.update(batch)
+            error = error or e
+            continue
+        missing.update(batch.keys() - {row["urlId"] for row in rows})
+    return missing, unapplied, error
+
+
+class AsyncpgRedirectRepository:
+    """
+    Serves redirect lookups and click updates over a dedicated asyncpg pool, bypassing the Prisma query engine.
+
+    asyncpg prepares each statement once per pooled connection and reuses it, so the hot
+    alias lookup costs one round trip to Postgres with no query-engine hop in between.
+    Click batches are applied to one counter slot of the current month in a single statement by unnesting parallel arrays.
+    """
+
+    def __init__(self, dsn: str, min_size: int, max_size: int):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def connect(self) -> None:
+        if asyncpg is None:
+            raise RuntimeError(
+                "REDIRECT_DB_DRIVER=asyncpg requires the asyncpg package to be installed"
+            )
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            server_settings={
+                "statement_timeout": str(
+                    int(project.circuit_breaker.DB_QUERY_TIMEOUT_SECONDS * 1000)
+                )
+            },
+        )
+
+    async def disconnect(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def find_by_alias(self, alias: str) -> Optional[UrlMapping]:
+        started = time.perf_counter()
+        try:
+            async with project.circuit_breaker.db_breaker.guard():
+                row = await self.pool.fetchrow(FIND_BY_ALIAS_SQL, alias)
+        finally:
+            project.query_instrumentation.record_query(
+                "Url", "asyncpg_find_by_alias", time.perf_counter() - started
+            )
+        if row is None:
+            return None
+        return UrlMapping(
+            id=row["id"],
+            originalUrl=row["originalUrl"],
+            alias=row["alias"],
+            expiresAt=_as_utc(row["expiresAt"]),
+            updatedAt=_as_utc(row["updatedAt"]),
+        )
+
+    async def increment_clicks(
+        self, counts: Dict[str, int], slot: int, aliases: Dict[str, str]
+    ) -> None:
+        started = time.perf_counter()
+        try:
+            async with project.circuit_breaker.db_breaker.guard():
+                await self.pool.execute(
+                    INCREMENT_CLICKS_SQL,
+                    list(counts.keys()),
+                    list(counts.values()),
+                    slot,
+                    project.analytics_partitions.month_bucket().date(),
+                )
+        finally:
+            project.query_instrumentation.record_query(
+                "Analytics", "asyncpg_increment_clicks", time.perf_counter() - started
+            )
+
+    async def fold_click_slots(self, idle_seconds: float) -> int:
+        started = time.perf_counter()
+        timeout_ms = int(
+            project.circuit_breaker.MAINTENANCE_QUERY_TIMEOUT_SECONDS * 1000
+        )
+        try:
+            with project.circuit_breaker.maintenance():
+                async with project.circuit_breaker.db_breaker.guard():
+                    async with self.pool.acquire() as connection:
+                        async with connection.transaction():
+                            await connection.execute(
+                                f"SET LOCAL statement_timeout = {timeout_ms}"
+                            )
+                            status = await connection.execute(
+                                FOLD_CLICK_SLOTS_SQL,
+                                idle_seconds,
+                                _fold_window_start().date(),
+                            )
+        finally:
+            project.query_instrumentation.record_query(
+                "Analytics", "asyncpg_fold_click_slots", time.perf_counter() - started
+            )
+        return int(status.rsplit(" ", 1)[-1])
+
+
+def _asyncpg_dsn(database_url: str) -> str:
+    """
+    Drops the Prisma-specific query parameters that asyncpg would otherwise send as server settings.
+    """
+    parts = urlsplit(database_url)
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query)
+        if key not in ("schema", "connection_limit", "pool_timeout", "pgbouncer")
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _create_repository() -> PrismaRedirectRepository | AsyncpgRedirectRepository:
+    driver = os.environ.get("REDIRECT_DB_DRIVER", "prisma")
+    if driver == "prisma":
+        return PrismaRedirectRepository()
+    if driver == "asyncpg":
+        if project.sharding.shard_router is not None:
+            raise ValueError(
+                "REDIRECT_DB_DRIVER=asyncpg does not support URL sharding"
+            )
+        database_url = os.environ.get("REDIRECT_DATABASE_URL") or os.environ.get(
+            "DATABASE_URL", ""
+        )
+        return AsyncpgRedirectRepository(
+            _asyncpg_dsn(database_url),
+            min_size=int(os.environ.get("REDIRECT_POOL_MIN_SIZE", "2")),
+            max_size=int(os.environ.get("REDIRECT_POOL_MAX_SIZE", "10")),
+        )
+    raise ValueError(f"Unknown REDIRECT_DB_DRIVER: {driver}")
+
+
+redirect_repository = _create_repository()
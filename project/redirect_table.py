@@ -0,0 +1,402 @@
+import array
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional, Tuple
+
+import prisma
+import prisma.models
+import project.circuit_breaker
+import project.redirect_repository
+import project.sharding
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_TABLE_PATH = os.environ.get("REDIRECT_TABLE_PATH", "")
+
+REDIRECT_TABLE_REBUILD_SECONDS = float(
+    os.environ.get("REDIRECT_TABLE_REBUILD_SECONDS", "60")
+)
+
+RELOAD_CHECK_SECONDS = 1.0
+
+MAX_OVERLAY_ENTRIES = 10000
+
+REBUILD_PAGE_SIZE = 5000
+
+MAGIC = b"RDT1"
+
+HEADER = struct.Struct("<4sIq")
+
+SLOT = struct.Struct("<QQ")
+
+RECORD = struct.Struct("<HHIqq")
+
+NO_EXPIRY = -(2**63)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+MICROSECOND = timedelta(microseconds=1)
+
+ACTIVE_MAPPINGS_PAGE_SQL = """
+SELECT id, alias, "originalUrl",
+    (extract(epoch FROM "expiresAt") * 1000000)::bigint AS expires,
+    (extract(epoch FROM "updatedAt") * 1000000)::bigint AS updated
+FROM "Url"
+WHERE alias IS NOT NULL
+  AND ("expiresAt" IS NULL OR "expiresAt" > now() AT TIME ZONE 'UTC')
+  AND id > $1
+ORDER BY id
+LIMIT $2
+"""
+
+
+def _hash(alias: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(alias, digest_size=8).digest(), "little")
+
+
+def _to_micros(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // MICROSECOND
+
+
+def _from_micros(value: int) -> datetime:
+    return EPOCH + value * MICROSECOND
+
+
+# One row of the table: alias, Url id, original URL, and expiry and last update in
+# microseconds since the epoch, with expiry None for links that never expire.
+TableRow = Tuple[str, str, str, Optional[int], int]
+
+
+class RedirectTableWriter:
+    """
+    Builds a redirect table from rows added in batches, without holding them all in memory.
+
+    The file is a header, a power-of-two array of (hash, record offset) slots sized for a load
+    factor of at most one half, and the packed records. Readers probe linearly from the alias
+    hash until they hit the alias or an empty slot. The slot count is only known once every
+    row is in, so `add` spools the packed records to a side file and keeps just their hashes
+    and offsets; `finish` writes the header and slots, appends the spool and atomically swaps
+    the result into place. Both do blocking file I/O and belong in a worker thread.
+    """
+
+    def __init__(self, path: str, built_at: datetime):
+        self.path = path
+        self.built_at = built_at
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.spool_path = f"{path}.{os.getpid()}.records"
+        self.spool = open(self.spool_path, "wb")
+        self.hashes = array.array("Q")
+        self.offsets = array.array("Q")
+        self.size = 0
+
+    def add(self, rows: Iterable[TableRow]) -> None:
+        """
+        Appends rows to the table; rows without an alias are skipped.
+        """
+        chunks = []
+        for alias, url_id, original_url, expires, updated in rows:
+            if not alias:
+                continue
+            alias_bytes = alias.encode()
+            id_bytes = url_id.encode()
+            url_bytes = original_url.encode()
+            record = (
+                RECORD.pack(
+                    len(alias_bytes),
+                    len(id_bytes),
+                    len(url_bytes),
+                    NO_EXPIRY if expires is None else expires,
+                    updated,
+                )
+                + alias_bytes
+                + id_bytes
+                + url_bytes
+            )
+            self.hashes.append(_hash(alias_bytes))
+            self.offsets.append(self.size)
+            self.size += len(record)
+            chunks.append(record)
+        self.spool.write(b"".join(chunks))
+
+    def finish(self) -> int:
+        """
+        Writes the table and renames it over `path`.
+
+        Returns:
+            int: The number of rows written.
+        """
+        self.spool.close()
+        slot_count = 1
+        while slot_count < len(self.hashes) * 2:
+            slot_count *= 2
+        mask = slot_count - 1
+        slots = bytearray(SLOT.size * slot_count)
+        records_start = HEADER.size + len(slots)
+        for alias_hash, offset in zip(self.hashes, self.offsets):
+            index = alias_hash & mask
+            while SLOT.unpack_from(slots, index * SLOT.size)[1]:
+                index = (index + 1) & mask
+            SLOT.pack_into(slots, index * SLOT.size, alias_hash, records_start + offset)
+        with open(self.tmp_path, "wb") as f, open(self.spool_path, "rb") as spool:
+            f.write(HEADER.pack(MAGIC, slot_count, _to_micros(self.built_at)))
+            f.write(slots)
+            shutil.copyfileobj(spool, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.tmp_path, self.path)
+        os.unlink(self.spool_path)
+        return len(self.hashes)
+
+    def abort(self) -> None:
+        self.spool.close()
+        for leftover in (self.spool_path, self.tmp_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(leftover)
+
+
+def write_redirect_table(
+    path: str,
+    mappings: Iterable[project.redirect_repository.UrlMapping],
+    built_at: datetime,
+) -> int:
+    """
+    Writes an immutable open-addressing hash table of alias to mapping and atomically swaps it into place.
+
+    Args:
+        path (str): Destination of the table; a temporary file next to it is renamed over it.
+        mappings (Iterable[UrlMapping]): The mappings to include. Mappings without an alias are skipped.
+        built_at (datetime): When the snapshot the mappings came from was taken.
+
+    Returns:
+        int: The number of mappings written.
+    """
+    writer = RedirectTableWriter(path, built_at)
+    try:
+        writer.add(
+            (
+                mapping.alias,
+                mapping.id,
+                mapping.originalUrl,
+                _to_micros(mapping.expiresAt) if mapping.expiresAt else None,
+                _to_micros(mapping.updatedAt),
+            )
+            for mapping in mappings
+        )
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class RedirectTable:
+    """
+    Read-only view of the redirect table file, memory-mapped so every worker shares one page-cache copy.
+
+    Writes made by this worker after the loaded snapshot was taken are kept in a small overlay
+    and consulted first; they are dropped once a newer snapshot is loaded. Lookups that miss
+    both fall through to the database.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.map: Optional[mmap.mmap] = None
+        self.slot_count = 0
+        self.built_at = EPOCH
+        self.identity: Optional[Tuple[int, int]] = None
+        self.next_check = 0.0
+        self.overlay: OrderedDict = OrderedDict()
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + RELOAD_CHECK_SECONDS
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        identity = (stat.st_ino, stat.st_mtime_ns)
+        if identity == self.identity:
+            return
+        with open(self.path, "rb") as f:
+            new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, slot_count, built_at = HEADER.unpack_from(new_map, 0)
+        if magic != MAGIC:
+            new_map.close()
+            logger.error("Ignoring redirect table %s with bad magic", self.path)
+            return
+        if self.map is not None:
+            self.map.close()
+        self.map = new_map
+        self.slot_count = slot_count
+        self.built_at = _from_micros(built_at)
+        self.identity = identity
+        for alias, (_, written_at) in list(self.overlay.items()):
+            if written_at < self.built_at:
+                del self.overlay[alias]
+
+    def record_write(self, mapping: project.redirect_repository.UrlMapping) -> None:
+        """
+        Makes a mapping written by this worker visible before the next table rebuild picks it up.
+        """
+        if not mapping.alias:
+            return
+        self.overlay[mapping.alias] = (mapping, datetime.now(timezone.utc))
+        self.overlay.move_to_end(mapping.alias)
+        while len(self.overlay) > MAX_OVERLAY_ENTRIES:
+            self.overlay.popitem(last=False)
+
+    def lookup(self, alias: str) -> Optional[project.redirect_repository.UrlMapping]:
+        """
+        Finds an alias in the overlay or the mapped table without touching the database.
+
+        Returns:
+            Optional[UrlMapping]: The mapping, or None if neither holds the alias.
+        """
+        self._maybe_reload()
+        overlaid = self.overlay.get(alias)
+        if overlaid is not None:
+            return overlaid[0]
+        if self.map is None:
+            return None
+        key = alias.encode()
+        alias_hash = _hash(key)
+        mask = self.slot_count - 1
+        index = alias_hash & mask
+        while True:
+            slot_hash, offset = SLOT.unpack_from(
+                self.map, HEADER.size + index * SLOT.size
+            )
+            if not offset:
+                return None
+            if slot_hash == alias_hash:
+                alias_len, id_len, url_len, expires, updated = RECORD.unpack_from(
+                    self.map, offset
+                )
+                start = offset + RECORD.size
+                if self.map[start : start + alias_len] == key:
+                    start += alias_len
+                    url_id = self.map[start : start + id_len].decode()
+                    start += id_len
+                    return project.redirect_repository.UrlMapping.construct(
+                        id=url_id,
+                        originalUrl=self.map[start : start + url_len].decode(),
+                        alias=alias,
+                        expiresAt=(
+                            _from_micros(expires) if expires != NO_EXPIRY else None
+                        ),
+                        updatedAt=_from_micros(updated),
+                    )
+            index = (index + 1) & mask
+
+
+async def _write_active_mappings(writer: RedirectTableWriter) -> None:
+    """
+    Streams every unexpired aliased Url row into `writer`, one page at a time.
+
+    Rows come back as plain column values with the timestamps already in microseconds, and
+    each page is packed and spooled in a worker thread, so a rebuild neither materialises the
+    whole Url table nor stalls the event loop serving redirects.
+    """
+    for client in project.sharding.database_clients():
+        # One transaction per database gives the pages a consistent snapshot and the
+        # maintenance query budget instead of the per-request one.
+        async with project.circuit_breaker.maintenance_transaction(
+            client
+        ) as transaction:
+            last_id = ""
+            while True:
+                rows = await transaction.query_raw(
+                    ACTIVE_MAPPINGS_PAGE_SQL, last_id, REBUILD_PAGE_SIZE
+                )
+                await asyncio.to_thread(
+                    writer.add,
+                    [
+                        (
+                            row["alias"],
+                            row["id"],
+                            row["originalUrl"],
+                            row["expires"],
+                            row["updated"],
+                        )
+                        for row in rows
+                    ],
+                )
+                if len(rows) < REBUILD_PAGE_SIZE:
+                    break
+                last_id = rows[-1]["id"]
+
+
+async def rebuild_redirect_table(path: str) -> Optional[int]:
+    """
+    Rebuilds the table from the Url table unless another worker holds the rebuild lock or the file is still fresh.
+
+    Returns:
+        Optional[int]: The number of mappings written, or None if this worker skipped the rebuild.
+    """
+    with open(f"{path}.lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            age = None
+        if age is not None and age < REDIRECT_TABLE_REBUILD_SECONDS / 2:
+            return None
+        writer = RedirectTableWriter(path, datetime.now(timezone.utc))
+        try:
+            await _write_active_mappings(writer)
+            return await asyncio.to_thread(writer.finish)
+        except BaseException:
+            writer.abort()
+            raise
+
+
+async def run_rebuilds(
+    path: str, interval: float = REDIRECT_TABLE_REBUILD_SECONDS
+) -> None:
+    """
+    Keeps the table fresh; every worker runs this but the file lock lets only one rebuild at a time.
+    """
+    while True:
+        try:
+            written = await rebuild_redirect_table(path)
+            if written is not None:
+                logger.info("Rebuilt redirect table with %d mappings", written)
+        except Exception:
+            logger.exception("Failed to rebuild redirect table %s", path)
+        await asyncio.sleep(interval)
+
+
+redirect_table = RedirectTable(REDIRECT_TABLE_PATH) if REDIRECT_TABLE_PATH else None
+
+
+def record_url_write(url: prisma.models.Url) -> None:
+    """
+    Adds a freshly written Url row to this worker's overlay when the redirect table is enabled.
+    """
+    if redirect_table is None:
+        return
+    redirect_table.record_write(
+        project.redirect_repository.UrlMapping(
+            id=url.id,
+            originalUrl=url.originalUrl,
+            alias=url.alias,
+            expiresAt=url.expiresAt,
+            updatedAt=url.updatedAt,
+        )
+    )
@@ -0,0 +1,222 @@
+import asyncio
+import hmac
+import os
+import signal
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Mapping, Optional
+
+from pydantic import BaseModel
+
+MAX_PROFILE_SECONDS = 60.0
+
+MIN_SAMPLE_INTERVAL_MS = 1.0
+
+MAX_STACK_DEPTH = 128
+
+MAX_OVERHEAD_RATIO = 0.02
+
+MAX_SAMPLE_INTERVAL_SECONDS = 1.0
+
+
+class SamplingProfileResponse(BaseModel):
+    """
+    Result of an on-demand sampling profile of this worker. The stacks are in the collapsed format understood by flamegraph.pl and speedscope.
+    """
+
+    duration_seconds: float
+    interval_ms: float
+    samples: int
+    overhead_ratio: float
+    collapsed_stacks: str
+
+
+class ProfileAlreadyRunningError(Exception):
+    """
+    Raised when a profile is requested while another one is still running in this worker.
+    """
+
+
+class _SamplingSession:
+    """
+    Samples the stack of the event loop thread from a SIGPROF interval timer.
+
+    The timer counts CPU time, and Python runs the signal handler on the main thread between
+    bytecodes, so each sample is the frame that was actually executing rather than wherever
+    the loop happened to be waiting. Samples are only recorded while the session filter
+    matches at least one in-flight request, or unconditionally when no route/header filter
+    was given. The handler measures the time it spends walking frames, doubles its interval
+    whenever that exceeds MAX_OVERHEAD_RATIO, and steps back towards the requested interval
+    once it is comfortably under budget again.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        route: Optional[str],
+        match_header: Optional[str],
+    ):
+        self.requested_interval = interval
+        self.interval = interval
+        self.route = route
+        self.header_name: Optional[str] = None
+        self.header_value: Optional[str] = None
+        if match_header:
+            name, _, value = match_header.partition("=")
+            self.header_name = name.strip().lower()
+            self.header_value = value.strip() or None
+        self.matching_in_flight = 0
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.sampling_time = 0.0
+        self._previous_handler = None
+
+    @property
+    def filtered(self) -> bool:
+        return self.route is not None or self.header_name is not None
+
+    def matches(self, path: str, headers: Mapping[str, str]) -> bool:
+        if self.route is not None and not path.startswith(self.route):
+            return False
+        if self.header_name is not None:
+            value = headers.get(self.header_name)
+            if value is None:
+                return False
+            if self.header_value is not None and value != self.header_value:
+                return False
+        return True
+
+    def start(self) -> None:
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame) -> None:
+        if self.filtered and self.matching_in_flight <= 0:
+            return
+        started = time.perf_counter()
+        if frame is not None:
+            self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+        spent = time.perf_counter() - started
+        self.sampling_time += spent
+        budget = self.interval * MAX_OVERHEAD_RATIO
+        if spent > budget and self.interval < MAX_SAMPLE_INTERVAL_SECONDS:
+            self._set_interval(min(self.interval * 2, MAX_SAMPLE_INTERVAL_SECONDS))
+        elif spent < budget / 4 and self.interval > self.requested_interval:
+            self._set_interval(max(self.interval / 2, self.requested_interval))
+
+    def _set_interval(self, interval: float) -> None:
+        self.interval = interval
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+
+_session: Optional[_SamplingSession] = None
+
+_session_lock = asyncio.Lock()
+
+
+def _collapse(frame) -> str:
+    """
+    Renders a frame chain root-first as `module:function;module:function`.
+    """
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def verify_admin_token(token: Optional[str]) -> None:
+    """
+    Checks the supplied token against the ADMIN_API_TOKEN environment variable.
+
+    Args:
+        token (Optional[str]): The token sent by the caller in the X-Admin-Token header.
+
+    Raises:
+        PermissionError: If no admin token is configured or the supplied token does not match.
+    """
+    expected = os.environ.get("ADMIN_API_TOKEN")
+    if not expected or not token or not hmac.compare_digest(token, expected):
+        raise PermissionError("Admin token required")
+
+
+@contextmanager
+def track_request(path: str, headers: Mapping[str, str]) -> Iterator[None]:
+    """
+    Marks a request as in flight for the active profiling session, if it matches the session filter.
+
+    This is a single attribute check when no session is running, so it is safe to keep on every request.
+    """
+    session = _session
+    if session is None or not session.filtered or not session.matches(path, headers):
+        yield
+        return
+    session.matching_in_flight += 1
+    try:
+        yield
+    finally:
+        session.matching_in_flight -= 1
+
+
+async def run_sampling_profile(
+    seconds: float,
+    interval_ms: float,
+    route: Optional[str] = None,
+    match_header: Optional[str] = None,
+) -> SamplingProfileResponse:
+    """
+    Samples the CPU time of this worker's event loop thread for a fixed duration and returns collapsed stacks.
+
+    Args:
+        seconds (float): How long to profile for, capped at MAX_PROFILE_SECONDS.
+        interval_ms (float): Sampling interval in milliseconds, no lower than MIN_SAMPLE_INTERVAL_MS.
+        route (Optional[str]): Only sample while a request whose path starts with this prefix is in flight.
+        match_header (Optional[str]): Only sample while a request carrying this header is in flight, given as `name` or `name=value`.
+
+    Returns:
+        SamplingProfileResponse: Result of an on-demand sampling profile of this worker.
+
+    Raises:
+        ValueError: If the duration is not positive.
+        ProfileAlreadyRunningError: If another profile is already running in this worker.
+        RuntimeError: If the event loop does not run on the main thread, which receives SIGPROF.
+    """
+    global _session
+    if seconds <= 0:
+        raise ValueError("Profile duration must be positive")
+    if threading.current_thread() is not threading.main_thread():
+        raise RuntimeError("Sampling needs the event loop to run on the main thread")
+    if _session_lock.locked():
+        raise ProfileAlreadyRunningError("A profile is already running in this worker")
+    async with _session_lock:
+        seconds = min(seconds, MAX_PROFILE_SECONDS)
+        interval = max(interval_ms, MIN_SAMPLE_INTERVAL_MS) / 1000
+        session = _SamplingSession(interval, route, match_header)
+        _session = session
+        started = time.perf_counter()
+        session.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            session.stop()
+            _session = None
+        elapsed = time.perf_counter() - started
+    collapsed = "\n".join(
+        f"{stack} {count}" for stack, count in sorted(session.stacks.items())
+    )
+    return SamplingProfileResponse(
+        duration_seconds=elapsed,
+        interval_ms=session.interval * 1000,
+        samples=session.samples,
+        overhead_ratio=session.sampling_time / elapsed if elapsed else 0.0,
+        collapsed_stacks=collapsed,
+    )
@@ -1,32 +1,72 @@
+import asyncio
 import logging
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, suppress
 from typing import Dict, Optional
 
+import project.analytics_partitions
 import project.api_get_url_analytics_service
 import project.api_shorten_url_service
+import project.circuit_breaker
+import project.click_counter
+import project.concurrency_limiter
 import project.get_original_url_service
 import project.get_url_analytics_service
+import project.http_caching
+import project.idempotency
 import project.login_service
 import project.logout_service
 import project.manage_api_keys_service
+import project.metrics
+import project.query_instrumentation
+import project.redirect_repository
+import project.redirect_table
 import project.register_service
+import project.sampling_profiler_service
+import project.sharding
 import project.shorten_url_service
 import project.update_preferences_service
 import project.update_profile_service
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Request
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import Response
-from prisma import Prisma
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 
 logger = logging.getLogger(__name__)
 
-db_client = Prisma(auto_register=True)
+db_client = project.query_instrumentation.InstrumentedPrisma(auto_register=True)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db_client.connect()
+    if project.sharding.shard_router is not None:
+        await project.sharding.shard_router.connect()
+    await project.redirect_repository.redirect_repository.connect()
+    click_flusher = asyncio.create_task(project.click_counter.click_buffer.run())
+    click_folder = asyncio.create_task(project.click_counter.run_fold_down())
+    background_tasks = [
+        click_folder,
+        asyncio.create_task(project.analytics_partitions.run_partition_maintenance()),
+        asyncio.create_task(
+            project.idempotency.run_purges(project.idempotency.idempotency_store)
+        ),
+    ]
+    if project.redirect_table.redirect_table is not None:
+        background_tasks.append(
+            asyncio.create_task(
+                project.redirect_table.run_rebuilds(
+                    project.redirect_table.REDIRECT_TABLE_PATH
+                )
+            )
+        )
     yield
+    for task in background_tasks + [click_flusher]:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await project.redirect_repository.redirect_repository.disconnect()
+    if project.sharding.shard_router is not None:
+        await project.sharding.shard_router.disconnect()
     await db_client.disconnect()
 
 
@@ -37,18 +77,107 @@ app = FastAPI(
 )
 
 
+@app.middleware("http")
+async def track_profiled_requests(request: Request, call_next):
+    with project.sampling_profiler_service.track_request(
+        request.url.path, request.headers
+    ):
+        return await call_next(request)
+
+
+# Registered before record_request_metrics so that middleware wraps this one and shed
+# requests still show up in the request log and latency histograms.
+@app.middleware("http")
+async def limit_concurrency(request: Request, call_next):
+    priority = project.concurrency_limiter.classify_request(
+        request.method, request.url.path
+    )
+    if priority is None:
+        return await call_next(request)
+    limiter = project.concurrency_limiter.concurrency_limiter
+    try:
+        await limiter.acquire(priority)
+    except project.concurrency_limiter.LoadShedError as e:
+        request.scope["shed_priority"] = priority
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(
+            content=jsonable_encoder(res),
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+    started = time.perf_counter()
+    succeeded = False
+    try:
+        response = await call_next(request)
+        succeeded = response.status_code < 500
+        return response
+    finally:
+        limiter.release(time.perf_counter() - started, succeeded)
+
+
+http_request_duration_seconds = project.metrics.Histogram(
+    "http_request_duration_seconds", "Time spent handling requests.", ["endpoint"]
+)
+
+http_request_db_queries = project.metrics.Histogram(
+    "http_request_db_queries",
+    "Database queries issued per request.",
+    ["endpoint"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50),
+)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    with project.query_instrumentation.collect_query_stats() as stats:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    endpoint = request.scope.get("endpoint")
+    if endpoint is not None:
+        endpoint_name = endpoint.__name__
+    elif "shed_priority" in request.scope:
+        endpoint_name = f"shed_{request.scope['shed_priority']}"
+    else:
+        endpoint_name = "unmatched"
+    http_request_duration_seconds.observe(elapsed, endpoint=endpoint_name)
+    http_request_db_queries.observe(stats.count, endpoint=endpoint_name)
+    logger.info(
+        "%s %s %d %.1fms queries=%d db_ms=%.1f",
+        request.method,
+        request.url.path,
+        response.status_code,
+        elapsed * 1000,
+        stats.count,
+        stats.total_ms,
+    )
+    return response
+
+
 @app.get(
     "/analytics/{urlId}",
     response_model=project.get_url_analytics_service.GetUrlAnalyticsResponse,
 )
 async def api_get_get_url_analytics(
-    urlId: str,
+    urlId: str, request: Request, response: Response
 ) -> project.get_url_analytics_service.GetUrlAnalyticsResponse | Response:
     """
     Fetch analytics data for a specific URL.
     """
     try:
-        res = await project.get_url_analytics_service.get_url_analytics(urlId)
+        analytics_slots = await project.get_url_analytics_service.load_url_analytics(
+            urlId
+        )
+        headers = project.get_url_analytics_service.url_analytics_cache_headers(
+            urlId, analytics_slots
+        )
+        if project.http_caching.is_not_modified(request.headers, headers):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        res = project.get_url_analytics_service.build_url_analytics_response(
+            urlId, analytics_slots
+        )
         return res
     except Exception as e:
         logger.exception("Error processing request")
@@ -66,14 +195,35 @@ async def api_get_get_url_analytics(
     response_model=project.get_original_url_service.GetOriginalUrlResponse,
 )
 async def api_get_get_original_url(
-    alias: str,
+    alias: str, request: Request, response: Response
 ) -> project.get_original_url_service.GetOriginalUrlResponse | Response:
     """
     Retrieves the original URL based on a shortened alias.
     """
     try:
-        res = await project.get_original_url_service.get_original_url(alias)
+        (
+            url_entry,
+            expiration_status,
+            stale,
+        ) = await project.get_original_url_service.resolve_original_url(alias)
+        headers = project.get_original_url_service.original_url_cache_headers(
+            url_entry, expiration_status, stale
+        )
+        if project.http_caching.is_not_modified(request.headers, headers):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        res = project.get_original_url_service.build_original_url_response(
+            url_entry, expiration_status
+        )
         return res
+    except project.circuit_breaker.CircuitOpenError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(
+            content=jsonable_encoder(res),
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
@@ -137,14 +287,25 @@ async def api_post_register(
     response_model=project.api_get_url_analytics_service.ApiGetUrlAnalyticsResponse,
 )
 async def api_get_api_get_url_analytics(
-    urlId: str, ApiKey: str
+    urlId: str, ApiKey: str, request: Request, response: Response
 ) -> project.api_get_url_analytics_service.ApiGetUrlAnalyticsResponse | Response:
     """
     Retrieve analytics for URLs via API.
     """
     try:
-        res = await project.api_get_url_analytics_service.api_get_url_analytics(
-            urlId, ApiKey
+        analytics_records = (
+            await project.api_get_url_analytics_service.load_api_url_analytics(
+                urlId, ApiKey
+            )
+        )
+        headers = project.api_get_url_analytics_service.api_url_analytics_cache_headers(
+            urlId, analytics_records
+        )
+        if project.http_caching.is_not_modified(request.headers, headers):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        res = project.api_get_url_analytics_service.build_api_url_analytics_response(
+            urlId, analytics_records
         )
         return res
     except Exception as e:
@@ -182,16 +343,32 @@ async def api_post_logout() -> project.logout_service.LogoutResponse | Response:
     response_model=project.api_shorten_url_service.ApiShortenUrlResponse,
 )
 async def api_post_api_shorten_url(
-    original_url: str, custom_alias: Optional[str]
+    original_url: str,
+    custom_alias: Optional[str],
+    idempotency_key: Optional[str] = Header(None),
 ) -> project.api_shorten_url_service.ApiShortenUrlResponse | Response:
     """
     Programmatically create shortened URLs via API.
     """
     try:
-        res = await project.api_shorten_url_service.api_shorten_url(
-            original_url, custom_alias
+        res = await project.idempotency.idempotency_store.run(
+            "api_shorten_url",
+            idempotency_key,
+            (original_url, custom_alias),
+            lambda: project.api_shorten_url_service.api_shorten_url(
+                original_url, custom_alias
+            ),
+            project.api_shorten_url_service.ApiShortenUrlResponse,
         )
         return res
+    except project.idempotency.IdempotencyKeyReusedError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=422)
+    except project.idempotency.IdempotencyKeyInProgressError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=409)
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
@@ -205,14 +382,30 @@ async def api_post_api_shorten_url(
 
 @app.post("/url/shorten", response_model=project.shorten_url_service.ShortenURLResponse)
 async def api_post_shorten_url(
-    long_url: str, custom_alias: Optional[str]
+    long_url: str,
+    custom_alias: Optional[str],
+    idempotency_key: Optional[str] = Header(None),
 ) -> project.shorten_url_service.ShortenURLResponse | Response:
     """
     Converts a long URL into a shortened URL.
     """
     try:
-        res = await project.shorten_url_service.shorten_url(long_url, custom_alias)
+        res = await project.idempotency.idempotency_store.run(
+            "shorten_url",
+            idempotency_key,
+            (long_url, custom_alias),
+            lambda: project.shorten_url_service.shorten_url(long_url, custom_alias),
+            project.shorten_url_service.ShortenURLResponse,
+        )
         return res
+    except project.idempotency.IdempotencyKeyReusedError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=422)
+    except project.idempotency.IdempotencyKeyInProgressError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=409)
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
@@ -302,3 +495,61 @@ async def api_put_update_profile(
             status_code=500,
             media_type="application/json",
         )
+
+
+@app.post(
+    "/admin/profile",
+    response_model=project.sampling_profiler_service.SamplingProfileResponse,
+)
+async def api_post_run_sampling_profile(
+    seconds: float = 10.0,
+    interval_ms: float = 5.0,
+    route: Optional[str] = None,
+    match_header: Optional[str] = None,
+    x_admin_token: Optional[str] = Header(None),
+) -> project.sampling_profiler_service.SamplingProfileResponse | Response:
+    """
+    Profile this worker's event loop for a number of seconds and return collapsed stacks.
+    """
+    try:
+        project.sampling_profiler_service.verify_admin_token(x_admin_token)
+        res = await project.sampling_profiler_service.run_sampling_profile(
+            seconds, interval_ms, route, match_header
+        )
+        return res
+    except PermissionError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=403)
+    except project.sampling_profiler_service.ProfileAlreadyRunningError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=409)
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=500)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def api_get_metrics(
+    x_admin_token: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+) -> PlainTextResponse | Response:
+    """
+    Expose this worker's metrics in the Prometheus text format.
+
+    Requires ADMIN_API_TOKEN, sent as X-Admin-Token or as a bearer token for scrapers.
+    """
+    if x_admin_token is None and authorization is not None:
+        scheme, _, credentials = authorization.partition(" ")
+        if scheme.lower() == "bearer":
+            x_admin_token = credentials.strip()
+    try:
+        project.sampling_profiler_service.verify_admin_token(x_admin_token)
+    except PermissionError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=403)
+    return PlainTextResponse(project.metrics.render_metrics())
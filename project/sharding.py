@@ -0,0 +1,193 @@
+import asyncio
+import bisect
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence
+
+import prisma
+import prisma.models
+import project.circuit_breaker
+import project.query_instrumentation
+
+URL_SHARD_DATABASE_URLS = os.environ.get("URL_SHARD_DATABASE_URLS", "")
+
+URL_SHARD_PREVIOUS_NAMES = os.environ.get("URL_SHARD_PREVIOUS_NAMES", "")
+
+VIRTUAL_NODES_PER_SHARD = 128
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping keys to shard names.
+
+    Each shard is placed at VIRTUAL_NODES_PER_SHARD points so load stays even, and adding
+    a shard only moves the keys between its points and their predecessors, roughly 1/N of
+    the total.
+    """
+
+    def __init__(
+        self, names: Sequence[str], virtual_nodes: int = VIRTUAL_NODES_PER_SHARD
+    ):
+        if not names:
+            raise ValueError("A hash ring needs at least one shard")
+        points = sorted(
+            (_hash(f"{name}#{replica}"), name)
+            for name in names
+            for replica in range(virtual_nodes)
+        )
+        self.names = list(names)
+        self.hashes = [point for point, _ in points]
+        self.owners = [name for _, name in points]
+
+    def shard_for(self, key: str) -> str:
+        index = bisect.bisect(self.hashes, _hash(key)) % len(self.hashes)
+        return self.owners[index]
+
+
+def parse_shard_urls(value: str) -> Dict[str, str]:
+    """
+    Parses `name=postgresql://...` pairs separated by commas.
+
+    Raises:
+        ValueError: If a pair has no name or no URL.
+    """
+    shards: Dict[str, str] = {}
+    for pair in filter(None, (part.strip() for part in value.split(","))):
+        name, _, url = pair.partition("=")
+        if not name.strip() or not url.strip():
+            raise ValueError(f"Invalid shard definition: {pair}")
+        shards[name.strip()] = url.strip()
+    return shards
+
+
+class ShardRouter:
+    """
+    Routes Url and Analytics rows to one of several databases by consistent hashing of the alias.
+
+    The shard of an alias is computed from the ring, so redirects, shortens and click
+    flushes need no directory lookup, and Url ids stay ordinary UUIDs that never change when
+    a row moves. Analytics reads, which only know the id, ask every shard in parallel.
+    While rows are being rebalanced after adding a shard, `previous_ring` describes the old
+    membership and lookups fall back to it.
+
+    Users and API keys stay in the primary database. Shards hold Url rows without a foreign
+    key to User (see migrations/url_shards.sql), so no user data is copied onto them.
+    Each shard client has its own circuit breaker, so one failing shard does not reject
+    calls to the others.
+    """
+
+    def __init__(self, shard_urls: Dict[str, str], previous_names: Sequence[str] = ()):
+        self.clients = {
+            name: project.query_instrumentation.InstrumentedPrisma(
+                datasource={"url": url},
+                breaker=project.circuit_breaker.database_breaker(f"shard_{name}"),
+            )
+            for name, url in shard_urls.items()
+        }
+        self.ring = HashRing(list(shard_urls))
+        self.previous_ring = HashRing(list(previous_names)) if previous_names else None
+
+    async def connect(self) -> None:
+        for client in self.clients.values():
+            await client.connect()
+
+    async def disconnect(self) -> None:
+        for client in self.clients.values():
+            if client.is_connected():
+                await client.disconnect()
+
+    def shard_for_alias(self, alias: str) -> str:
+        return self.ring.shard_for(alias)
+
+    def client_for_alias(self, alias: str) -> prisma.Prisma:
+        return self.clients[self.shard_for_alias(alias)]
+
+    def previous_client_for_alias(self, alias: str) -> Optional[prisma.Prisma]:
+        """
+        Returns the client of the shard that owned `alias` before the last shard was added, if that differs.
+        """
+        if self.previous_ring is None:
+            return None
+        previous_shard = self.previous_ring.shard_for(alias)
+        if previous_shard == self.shard_for_alias(alias):
+            return None
+        return self.clients[previous_shard]
+
+    async def find_url_by_alias(self, alias: str) -> Optional[prisma.models.Url]:
+        url = await self.client_for_alias(alias).url.find_unique(where={"alias": alias})
+        previous_client = self.previous_client_for_alias(alias)
+        if url is None and previous_client is not None:
+            url = await previous_client.url.find_unique(where={"alias": alias})
+        return url
+
+    async def find_client_for_url_id(self, url_id: str) -> Optional[prisma.Prisma]:
+        clients = list(self.clients.values())
+        urls = await asyncio.gather(
+            *(client.url.find_unique(where={"id": url_id}) for client in clients)
+        )
+        for client, url in zip(clients, urls):
+            if url is not None:
+                return client
+        return None
+
+
+def _create_router() -> Optional[ShardRouter]:
+    shard_urls = parse_shard_urls(URL_SHARD_DATABASE_URLS)
+    if not shard_urls:
+        return None
+    previous_names = [
+        name.strip() for name in URL_SHARD_PREVIOUS_NAMES.split(",") if name.strip()
+    ]
+    return ShardRouter(shard_urls, previous_names)
+
+
+shard_router = _create_router()
+
+
+def database_clients() -> List[prisma.Prisma]:
+    """
+    Returns the clients of every database holding Url and Analytics rows.
+    """
+    if shard_router is None:
+        return [prisma.get_client()]
+    return list(shard_router.clients.values())
+
+
+def client_for_alias(alias: str) -> prisma.Prisma:
+    if shard_router is None:
+        return prisma.get_client()
+    return shard_router.client_for_alias(alias)
+
+
+def previous_client_for_alias(alias: str) -> Optional[prisma.Prisma]:
+    if shard_router is None:
+        return None
+    return shard_router.previous_client_for_alias(alias)
+
+
+async def find_client_for_url_id(url_id: str) -> Optional[prisma.Prisma]:
+    """
+    Returns the client of the database holding the Url row with this id, or None if no database has it.
+    """
+    if shard_router is None:
+        return prisma.get_client()
+    return await shard_router.find_client_for_url_id(url_id)
+
+
+async def find_url_by_alias(alias: str) -> Optional[prisma.models.Url]:
+    if shard_router is None:
+        return await prisma.models.Url.prisma().find_unique(where={"alias": alias})
+    return await shard_router.find_url_by_alias(alias)
+
+
+async def create_url(data: dict) -> prisma.models.Url:
+    """
+    Creates a Url row on the database that owns `data["alias"]`.
+    """
+    return await client_for_alias(data["alias"]).url.create(data=data)
@@ -2,8 +2,8 @@ import random
 import string
 from typing import Optional
 
-import prisma
-import prisma.models
+import project.redirect_table
+import project.sharding
 from pydantic import BaseModel
 
 
@@ -50,19 +50,18 @@ async def shorten_url(
         short_url = None
         while not is_unique:
             tmp_short_url = await _generate_short_url()
-            existing_url = await prisma.models.Url.prisma().find_unique(
-                where={"shortUrl": tmp_short_url}
-            )
+            existing_url = await project.sharding.find_url_by_alias(tmp_short_url)
             if not existing_url:
                 is_unique = True
                 short_url = tmp_short_url
-    await prisma.models.Url.prisma().create(
-        data={
+    url_entry = await project.sharding.create_url(
+        {
             "originalUrl": long_url,
             "shortUrl": short_url,
-            "alias": custom_alias,
+            "alias": short_url,
             "userId": "known-user-id-placeholder",
         }
     )
+    project.redirect_table.record_url_write(url_entry)
     shortened_url = ShortenURLResponse(shortened_url=short_url)
     return shortened_url
@@ -37,9 +37,6 @@ async def update_profile(
         UpdateUserProfileResponse: Response model after the user has successfully updated their profile information, including
                                    the message indicating success, the fields that were updated, and the timestamp of the update.
     """
-    user = await prisma.models.User.prisma().find_unique(where={"email": email})
-    if not user:
-        raise ValueError("User with this email does not exist.")
     update_data = {}
     updatedFields = []
     if name:
@@ -55,9 +52,13 @@ async def update_profile(
         update_data["website"] = website
         updatedFields.append("website")
     if update_data:
-        await prisma.models.User.prisma().update(
+        user = await prisma.models.User.prisma().update(
             where={"email": email}, data=update_data
         )
+    else:
+        user = await prisma.models.User.prisma().find_unique(where={"email": email})
+    if not user:
+        raise ValueError("User with this email does not exist.")
     return UpdateUserProfileResponse(
         message="User profile updated successfully.",
         updatedFields=updatedFields,
@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import project.analytics_partitions
+from project.analytics_partitions import add_months, month_bucket, retention_window
+
+
+def utc(year, month, day=1, *args):
+    return datetime(year, month, day, *args, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def now(monkeypatch):
+    monkeypatch.setattr(project.analytics_partitions, "ANALYTICS_RETENTION_MONTHS", 3)
+    current = utc(2024, 2)
+    monkeypatch.setattr(
+        project.analytics_partitions,
+        "month_bucket",
+        lambda value=None: month_bucket(value) if value else current,
+    )
+    return current
+
+
+class FakeClient:
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.statements = []
+
+    async def query_raw(self, sql):
+        assert sql is project.analytics_partitions.LIST_PARTITIONS_SQL
+        return [{"name": name} for name in self.partitions]
+
+    async def execute_raw(self, sql):
+        self.statements.append(sql)
+        return 0
+
+
+def test_month_bucket_is_the_start_of_the_utc_month():
+    local = timezone(timedelta(hours=-5))
+
+    assert month_bucket(utc(2024, 3, 31, 23, 59)) == utc(2024, 3)
+    assert month_bucket(datetime(2024, 3, 31, 20, tzinfo=local)) == utc(2024, 4)
+
+
+@pytest.mark.parametrize(
+    "bucket, months, expected",
+    [
+        (utc(2024, 1), 0, utc(2024, 1)),
+        (utc(2024, 11), 2, utc(2025, 1)),
+        (utc(2024, 12), 1, utc(2025, 1)),
+        (utc(2024, 1), -1, utc(2023, 12)),
+        (utc(2024, 2), -13, utc(2023, 1)),
+        (utc(2024, 1), 24, utc(2026, 1)),
+    ],
+)
+def test_add_months_crosses_year_boundaries(bucket, months, expected):
+    assert add_months(bucket, months) == expected
+
+
+def test_retention_window_covers_the_retained_months(now):
+    assert retention_window() == (utc(2023, 12), utc(2024, 3))
+
+
+def test_partition_names_match_the_pattern():
+    name = project.analytics_partitions.partition_name(utc(2024, 2))
+
+    assert name == "Analytics_2024_02"
+    assert project.analytics_partitions.PARTITION_NAME.match(name).groups() == (
+        "2024",
+        "02",
+    )
+
+
+def test_only_partitions_before_the_window_are_dropped(now):
+    client = FakeClient(
+        [
+            "Analytics_default",
+            "Analytics_2023_10",
+            "Analytics_2023_11",
+            "Analytics_2023_12",
+            "Analytics_2024_02",
+            "Analytics_2024_04",
+            "Analytics_2023_11_old",
+            "Analytics_unpartitioned",
+        ]
+    )
+
+    dropped = asyncio.run(project.analytics_partitions.drop_expired_partitions(client))
+
+    assert dropped == ["Analytics_2023_10", "Analytics_2023_11"]
+    assert client.statements == [
+        'DROP TABLE IF EXISTS "Analytics_2023_10"',
+        'DROP TABLE IF EXISTS "Analytics_2023_11"',
+    ]
+
+
+def test_upcoming_partitions_are_created(now, monkeypatch):
+    monkeypatch.setattr(project.analytics_partitions, "ANALYTICS_PARTITIONS_AHEAD", 1)
+    client = FakeClient([])
+
+    asyncio.run(project.analytics_partitions.ensure_partitions(client))
+
+    assert client.statements == [
+        'CREATE TABLE IF NOT EXISTS "Analytics_2024_02" PARTITION OF "Analytics" '
+        "FOR VALUES FROM ('2024-02-01') TO ('2024-03-01')",
+        'CREATE TABLE IF NOT EXISTS "Analytics_2024_03" PARTITION OF "Analytics" '
+        "FOR VALUES FROM ('2024-03-01') TO ('2024-04-01')",
+    ]
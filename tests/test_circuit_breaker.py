@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+
+import project.circuit_breaker
+from project.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitOpenError
+
+
+class Boom(Exception):
+    pass
+
+
+class Answered(Exception):
+    pass
+
+
+def make_breaker(**kwargs):
+    kwargs.setdefault("failure_threshold", 3)
+    kwargs.setdefault("reset_timeout", 10)
+    kwargs.setdefault("call_timeout", 1)
+    return project.circuit_breaker.CircuitBreaker(
+        "test", ignored=(Answered,), **kwargs
+    )
+
+
+async def call(breaker, result=None, delay=0.0):
+    async with breaker.guard():
+        await asyncio.sleep(delay)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+async def fail(breaker, times):
+    for _ in range(times):
+        with pytest.raises(Boom):
+            await call(breaker, Boom())
+
+
+def expire_reset_timeout(breaker):
+    breaker.opened_at -= breaker.reset_timeout
+
+
+def test_opens_after_consecutive_failures():
+    async def scenario():
+        breaker = make_breaker()
+        await fail(breaker, 2)
+        assert breaker.state == CLOSED
+        await fail(breaker, 1)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            await call(breaker)
+
+    asyncio.run(scenario())
+
+
+def test_success_resets_the_failure_count():
+    async def scenario():
+        breaker = make_breaker()
+        await fail(breaker, 2)
+        await call(breaker)
+        await fail(breaker, 2)
+        assert breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_ignored_errors_count_as_successes():
+    async def scenario():
+        breaker = make_breaker()
+        await fail(breaker, 2)
+        with pytest.raises(Answered):
+            await call(breaker, Answered())
+        await fail(breaker, 2)
+        assert breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_timeouts_count_as_failures():
+    async def scenario():
+        breaker = make_breaker(failure_threshold=1, call_timeout=0.01)
+        with pytest.raises(TimeoutError):
+            await call(breaker, delay=1)
+        assert breaker.state == OPEN
+
+    asyncio.run(scenario())
+
+
+def test_successful_probe_closes_the_breaker():
+    async def scenario():
+        breaker = make_breaker()
+        await fail(breaker, 3)
+        expire_reset_timeout(breaker)
+        assert await call(breaker, "probed") == "probed"
+        assert breaker.state == CLOSED
+        assert breaker.failures == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_reopens_the_breaker():
+    async def scenario():
+        breaker = make_breaker()
+        await fail(breaker, 3)
+        expire_reset_timeout(breaker)
+        await fail(breaker, 1)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            await call(breaker)
+
+    asyncio.run(scenario())
+
+
+def test_only_one_probe_runs_at_a_time():
+    async def scenario():
+        breaker = make_breaker()
+        await fail(breaker, 3)
+        expire_reset_timeout(breaker)
+        probe = asyncio.create_task(call(breaker, delay=0.05))
+        await asyncio.sleep(0)
+        assert breaker.state == HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            await call(breaker)
+        await probe
+        assert breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_maintenance_calls_bypass_the_breaker():
+    async def scenario():
+        breaker = make_breaker(call_timeout=0.01)
+        await fail(breaker, 3)
+        with project.circuit_breaker.maintenance():
+            assert await call(breaker, "done", delay=0.02) == "done"
+            with pytest.raises(Boom):
+                await call(breaker, Boom())
+        assert breaker.state == OPEN
+        assert breaker.failures == 3
+
+    asyncio.run(scenario())
+
+
+def test_statement_timeout_url_adds_the_server_side_timeout():
+    url = project.circuit_breaker.statement_timeout_url(
+        "postgresql://u:p@db:5432/app?schema=public", timeout=2
+    )
+
+    assert url == (
+        "postgresql://u:p@db:5432/app?schema=public"
+        "&options=-c%20statement_timeout%3D2000"
+    )
+    assert project.circuit_breaker.statement_timeout_url(url, timeout=5) == url
+
+
+def test_rejections_say_when_the_breaker_will_probe():
+    async def scenario():
+        breaker = make_breaker(reset_timeout=30)
+        await fail(breaker, 3)
+        breaker.opened_at -= 10.5
+        with pytest.raises(CircuitOpenError) as rejected:
+            await call(breaker)
+        assert rejected.value.retry_after == 20
+
+        expire_reset_timeout(breaker)
+        probe = asyncio.create_task(call(breaker, delay=0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError) as rejected:
+            await call(breaker)
+        assert rejected.value.retry_after == 1
+        await probe
+
+    asyncio.run(scenario())
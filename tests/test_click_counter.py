@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+import project.click_counter
+import project.redirect_repository
+from project.redirect_repository import ClickFlushError
+
+
+class FakeRepository:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.flushes = []
+
+    async def increment_clicks(self, counts, slot, aliases):
+        self.flushes.append((counts, slot, aliases))
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+@pytest.fixture
+def repository(monkeypatch):
+    fake = FakeRepository()
+    monkeypatch.setattr(project.redirect_repository, "redirect_repository", fake)
+    return fake
+
+
+def make_buffer(slots=3, next_slot=0):
+    buffer = project.click_counter.ClickBuffer(slots)
+    buffer.next_slot = next_slot
+    return buffer
+
+
+def test_flush_sends_the_batch_with_its_aliases(repository):
+    buffer = make_buffer()
+    buffer.record("u1", "one")
+    buffer.record("u1", "one")
+    buffer.record("u2", "two")
+
+    asyncio.run(buffer.flush())
+
+    assert repository.flushes == [({"u1": 2, "u2": 1}, 0, {"u1": "one", "u2": "two"})]
+    assert not buffer.pending
+    assert not buffer.aliases
+
+
+def test_slots_rotate_across_flushes(repository):
+    buffer = make_buffer(slots=3, next_slot=1)
+
+    async def flush_clicks(times):
+        for _ in range(times):
+            buffer.record("u1", "one")
+            await buffer.flush()
+
+    asyncio.run(flush_clicks(4))
+
+    assert [slot for _, slot, _ in repository.flushes] == [1, 2, 0, 1]
+
+
+def test_empty_flush_does_not_use_a_slot(repository):
+    buffer = make_buffer()
+
+    asyncio.run(buffer.flush())
+
+    assert repository.flushes == []
+    assert buffer.next_slot == 0
+
+
+def test_partial_failure_requeues_only_the_unapplied_counts(repository):
+    buffer = make_buffer()
+    buffer.record("u1", "one")
+    buffer.record("u2", "two")
+    repository.errors.append(ClickFlushError({"u2": 1}))
+
+    async def scenario():
+        await buffer.flush()
+        assert buffer.pending == {"u2": 1}
+        assert buffer.aliases == {"u2": "two"}
+        buffer.record("u2", "two")
+        await buffer.flush()
+
+    asyncio.run(scenario())
+
+    assert repository.flushes[-1] == ({"u2": 2}, 1, {"u2": "two"})
+
+
+def test_other_errors_requeue_the_whole_batch(repository):
+    buffer = make_buffer()
+    buffer.record("u1", "one")
+    buffer.record("u2", "two")
+    repository.errors.append(RuntimeError("database unavailable"))
+
+    asyncio.run(buffer.flush())
+
+    assert buffer.pending == {"u1": 1, "u2": 1}
+    assert buffer.aliases == {"u1": "one", "u2": "two"}
+
+
+def test_requeued_counts_merge_with_clicks_recorded_during_the_flush(repository):
+    buffer = make_buffer()
+    buffer.record("u1", "one")
+
+    async def increment_clicks(counts, slot, aliases):
+        buffer.record("u1", "one")
+        buffer.record("u3", "three")
+        raise RuntimeError("database unavailable")
+
+    repository.increment_clicks = increment_clicks
+    asyncio.run(buffer.flush())
+
+    assert buffer.pending == {"u1": 2, "u3": 1}
+    assert buffer.aliases == {"u1": "one", "u3": "three"}
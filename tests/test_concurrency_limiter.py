@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+import project.concurrency_limiter
+from project.concurrency_limiter import (
+    CRITICAL,
+    NORMAL,
+    SHEDDABLE,
+    LoadShedError,
+    classify_request,
+)
+
+
+def make_limiter(initial=10):
+    return project.concurrency_limiter.AdaptiveConcurrencyLimiter(
+        initial=initial, minimum=1, maximum=100, latency_target=0.1
+    )
+
+
+async def fill(limiter, priority, count):
+    for _ in range(count):
+        await limiter.acquire(priority)
+
+
+def test_lower_classes_are_shed_first():
+    async def scenario():
+        limiter = make_limiter()
+        await fill(limiter, NORMAL, 6)
+        with pytest.raises(LoadShedError):
+            await limiter.acquire(SHEDDABLE)
+        await fill(limiter, NORMAL, 2)
+        with pytest.raises(LoadShedError):
+            await limiter.acquire(NORMAL)
+        await fill(limiter, CRITICAL, 2)
+        assert limiter.in_flight == 10
+
+    asyncio.run(scenario())
+
+
+def test_freed_slots_go_to_higher_priorities_first():
+    async def scenario():
+        limiter = make_limiter()
+        await fill(limiter, CRITICAL, 10)
+        admitted = []
+
+        async def wait(priority):
+            await limiter.acquire(priority)
+            admitted.append(priority)
+
+        normal = asyncio.create_task(wait(NORMAL))
+        await asyncio.sleep(0)
+        critical = asyncio.create_task(wait(CRITICAL))
+        await asyncio.sleep(0)
+        limiter.release(latency=0.01, succeeded=True)
+        await critical
+        assert admitted == [CRITICAL]
+        with pytest.raises(LoadShedError):
+            await normal
+
+    asyncio.run(scenario())
+
+
+def test_queued_request_gets_a_slot_released_in_time():
+    async def scenario():
+        limiter = make_limiter()
+        await fill(limiter, NORMAL, 8)
+        waiting = asyncio.create_task(limiter.acquire(NORMAL))
+        await asyncio.sleep(0)
+        limiter.release(latency=0.01, succeeded=True)
+        await waiting
+        assert limiter.in_flight == 8
+
+    asyncio.run(scenario())
+
+
+def test_new_requests_do_not_overtake_queued_ones():
+    async def scenario():
+        limiter = make_limiter()
+        await fill(limiter, CRITICAL, 10)
+        waiting = asyncio.create_task(limiter.acquire(CRITICAL))
+        await asyncio.sleep(0)
+        limiter.limit = 20
+        with pytest.raises(LoadShedError):
+            await limiter.acquire(SHEDDABLE)
+        limiter.release(latency=0.01, succeeded=True)
+        await waiting
+
+    asyncio.run(scenario())
+
+
+def test_slow_or_failed_requests_shrink_the_limit_once_per_interval():
+    async def scenario():
+        limiter = make_limiter()
+        await fill(limiter, NORMAL, 3)
+        limiter.release(latency=1.0, succeeded=True)
+        assert limiter.limit == pytest.approx(9)
+        limiter.release(latency=0.01, succeeded=False)
+        assert limiter.limit == pytest.approx(9)
+        limiter.last_decrease -= 1
+        limiter.release(latency=0.01, succeeded=False)
+        assert limiter.limit == pytest.approx(8.1)
+
+    asyncio.run(scenario())
+
+
+def test_fast_requests_grow_the_limit_only_while_half_of_it_is_used():
+    async def scenario():
+        limiter = make_limiter()
+        await fill(limiter, NORMAL, 6)
+        limiter.release(latency=0.01, succeeded=True)
+        assert limiter.limit == pytest.approx(10.1)
+        for _ in range(5):
+            limiter.release(latency=0.01, succeeded=True)
+        assert limiter.limit == pytest.approx(10.1)
+
+    asyncio.run(scenario())
+
+
+def test_requests_are_classified_by_endpoint():
+    assert classify_request("GET", "/url/abc") == CRITICAL
+    assert classify_request("POST", "/url/shorten") == NORMAL
+    assert classify_request("GET", "/analytics/123") == SHEDDABLE
+    assert classify_request("GET", "/api/analytics/123") == SHEDDABLE
+    assert classify_request("POST", "/auth/login") == SHEDDABLE
+    assert classify_request("GET", "/metrics") is None
+    assert classify_request("POST", "/admin/profile") is None
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import project.click_counter
+import project.get_original_url_service
+import project.redirect_repository
+import project.redirect_table
+from project.circuit_breaker import CircuitOpenError
+from project.redirect_repository import UrlMapping
+
+MAPPING = UrlMapping(
+    id="id-1",
+    originalUrl="https://example.com/",
+    alias="abc",
+    updatedAt=datetime(2024, 5, 1, tzinfo=timezone.utc),
+)
+
+
+class FakeRepository:
+    def __init__(self):
+        self.error = None
+
+    async def find_by_alias(self, alias):
+        if self.error is not None:
+            raise self.error
+        return MAPPING if alias == MAPPING.alias else None
+
+
+@pytest.fixture
+def repository(monkeypatch):
+    fake = FakeRepository()
+    monkeypatch.setattr(project.redirect_repository, "redirect_repository", fake)
+    monkeypatch.setattr(project.redirect_table, "redirect_table", None)
+    monkeypatch.setattr(
+        project.get_original_url_service,
+        "last_known_mappings",
+        project.get_original_url_service.LastKnownMappings(),
+    )
+    monkeypatch.setattr(
+        project.click_counter, "click_buffer", project.click_counter.ClickBuffer()
+    )
+    return fake
+
+
+def resolve(alias="abc"):
+    return asyncio.run(project.get_original_url_service.resolve_original_url(alias))
+
+
+def test_fresh_redirects_are_publicly_cacheable(repository):
+    url_entry, status, stale = resolve()
+
+    assert (url_entry, status, stale) == (MAPPING, "active", False)
+    headers = project.get_original_url_service.original_url_cache_headers(
+        url_entry, status, stale
+    )
+    assert headers["Cache-Control"].startswith("public, max-age=")
+
+
+def test_stale_redirects_are_not_cacheable(repository):
+    resolve()
+    repository.error = CircuitOpenError("database circuit is open", 5)
+
+    url_entry, status, stale = resolve()
+
+    assert (url_entry, status, stale) == (MAPPING, "active", True)
+    assert project.get_original_url_service.original_url_cache_headers(
+        url_entry, status, stale
+    ) == {"Cache-Control": "no-cache"}
+    assert project.click_counter.click_buffer.pending == {"id-1": 2}
+
+
+def test_failed_lookup_without_a_known_mapping_propagates(repository):
+    repository.error = CircuitOpenError("database circuit is open", 5)
+
+    with pytest.raises(CircuitOpenError):
+        resolve()
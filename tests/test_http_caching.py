@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+import project.http_caching
+
+LAST_MODIFIED = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+ETAG = project.http_caching.make_etag("id", "https://example.com/")
+
+RESPONSE_HEADERS = project.http_caching.cache_headers(
+    ETAG, LAST_MODIFIED, "public, max-age=60"
+)
+
+
+def is_not_modified(**request_headers):
+    return project.http_caching.is_not_modified(
+        {name.replace("_", "-"): value for name, value in request_headers.items()},
+        RESPONSE_HEADERS,
+    )
+
+
+def test_matching_etag_is_not_modified():
+    assert is_not_modified(if_none_match=ETAG)
+
+
+def test_etag_in_a_list_is_not_modified():
+    assert is_not_modified(if_none_match=f'"other", {ETAG}')
+
+
+def test_weak_etag_matches_its_strong_form():
+    assert is_not_modified(if_none_match=f"W/{ETAG}")
+
+
+def test_wildcard_is_not_modified():
+    assert is_not_modified(if_none_match="*")
+
+
+def test_different_etag_is_modified():
+    assert not is_not_modified(if_none_match='"stale"')
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    assert not is_not_modified(
+        if_none_match='"stale"',
+        if_modified_since=RESPONSE_HEADERS["Last-Modified"],
+    )
+
+
+def test_if_modified_since_at_or_after_last_modified_is_not_modified():
+    assert is_not_modified(if_modified_since=RESPONSE_HEADERS["Last-Modified"])
+    assert is_not_modified(if_modified_since="Thu, 02 May 2024 00:00:00 GMT")
+
+
+def test_if_modified_since_before_last_modified_is_modified():
+    assert not is_not_modified(if_modified_since="Tue, 30 Apr 2024 00:00:00 GMT")
+
+
+def test_malformed_if_modified_since_is_modified():
+    assert not is_not_modified(if_modified_since="yesterday")
+
+
+def test_unconditional_request_is_modified():
+    assert not is_not_modified()
+
+
+def test_response_without_etag_is_modified():
+    assert not project.http_caching.is_not_modified({"if-none-match": "*"}, {})
+
+
+def test_etag_changes_with_its_parts():
+    assert project.http_caching.make_etag("a", 1) == project.http_caching.make_etag(
+        "a", 1
+    )
+    assert project.http_caching.make_etag("a", 1) != project.http_caching.make_etag(
+        "a", 2
+    )
@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+import pytest
+from pydantic import BaseModel
+
+import project.idempotency
+from project.idempotency import (
+    IdempotencyKeyInProgressError,
+    IdempotencyKeyReusedError,
+)
+
+
+class ShortenResponse(BaseModel):
+    shortened_url: str
+
+
+class FakeKeyTable:
+    """
+    Stands in for the "IdempotencyKey" table that every worker's store shares.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.queries = 0
+
+    async def query_raw(self, sql, *args):
+        self.queries += 1
+        now = time.monotonic()
+        if sql is project.idempotency.CLAIM_KEY_SQL:
+            operation, key, fingerprint, claim, lease = args
+            row = self.rows.get((operation, key))
+            if row is not None and row["expiresAt"] >= now:
+                return []
+            self.rows[(operation, key)] = {
+                "fingerprint": fingerprint,
+                "claim": claim,
+                "response": None,
+                "expiresAt": now + lease,
+            }
+            return [{"claim": claim}]
+        if sql is project.idempotency.FIND_KEY_SQL:
+            row = self.rows.get(args)
+            if row is None or row["expiresAt"] < now:
+                return []
+            return [row]
+        raise AssertionError(sql)
+
+    async def execute_raw(self, sql, *args):
+        self.queries += 1
+        operation, key, claim = args[:3]
+        row = self.rows.get((operation, key))
+        if row is None or row["claim"] != claim:
+            return 0
+        if sql is project.idempotency.STORE_RESPONSE_SQL:
+            row["response"] = args[3]
+            row["expiresAt"] = time.monotonic() + args[4]
+        elif sql is project.idempotency.RELEASE_KEY_SQL:
+            if row["response"] is not None:
+                return 0
+            del self.rows[(operation, key)]
+        else:
+            raise AssertionError(sql)
+        return 1
+
+
+class Shortener:
+    def __init__(self, delay=0.0, failures=0):
+        self.delay = delay
+        self.failures = failures
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        return ShortenResponse(shortened_url=f"result-{self.calls}")
+
+
+def worker(table, **kwargs):
+    kwargs.setdefault("poll_interval", 0.01)
+    return project.idempotency.IdempotencyStore(client=table, **kwargs)
+
+
+def shorten(store, shortener, key="key", url="url", operation="shorten"):
+    return store.run(operation, key, (url,), shortener, ShortenResponse)
+
+
+def test_concurrent_duplicates_in_one_worker_share_one_call():
+    async def scenario():
+        table = FakeKeyTable()
+        store = worker(table)
+        shortener = Shortener(delay=0.05)
+        results = await asyncio.gather(*(shorten(store, shortener) for _ in range(10)))
+        assert {result.shortened_url for result in results} == {"result-1"}
+        assert shortener.calls == 1
+        assert table.queries == 2
+        assert not store.in_flight
+
+    asyncio.run(scenario())
+
+
+def test_retry_on_another_worker_replays_the_stored_result():
+    async def scenario():
+        table = FakeKeyTable()
+        shortener = Shortener()
+        first = await shorten(worker(table), shortener)
+        retry = await shorten(worker(table), shortener)
+        assert first.shortened_url == retry.shortened_url == "result-1"
+        assert shortener.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_on_another_worker_waits_for_the_running_request():
+    async def scenario():
+        table = FakeKeyTable()
+        shortener = Shortener(delay=0.05)
+        results = await asyncio.gather(
+            shorten(worker(table), shortener), shorten(worker(table), shortener)
+        )
+        assert [result.shortened_url for result in results] == ["result-1"] * 2
+        assert shortener.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_gives_up_when_the_running_request_outlasts_its_lease():
+    async def scenario():
+        table = FakeKeyTable()
+        slow = asyncio.create_task(shorten(worker(table), Shortener(delay=0.2)))
+        await asyncio.sleep(0.01)
+        with pytest.raises(IdempotencyKeyInProgressError):
+            await shorten(worker(table, lease=0.05), Shortener())
+        await slow
+
+    asyncio.run(scenario())
+
+
+def test_reused_key_with_other_parameters_is_rejected():
+    async def scenario():
+        table = FakeKeyTable()
+        store = worker(table)
+        shortener = Shortener()
+        await shorten(store, shortener)
+        with pytest.raises(IdempotencyKeyReusedError):
+            await shorten(store, shortener, url="other-url")
+        with pytest.raises(IdempotencyKeyReusedError):
+            await shorten(worker(table), shortener, url="other-url")
+        assert shortener.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_same_key_on_another_operation_runs_separately():
+    async def scenario():
+        store = worker(FakeKeyTable())
+        shortener = Shortener()
+        await shorten(store, shortener)
+        await shorten(store, shortener, operation="api_shorten")
+        assert shortener.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_failures_are_shared_then_released():
+    async def scenario():
+        table = FakeKeyTable()
+        store = worker(table)
+        shortener = Shortener(delay=0.05, failures=1)
+        results = await asyncio.gather(
+            shorten(store, shortener),
+            shorten(store, shortener),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert not table.rows
+        retry = await shorten(worker(table), shortener)
+        assert retry.shortened_url == "result-2"
+
+    asyncio.run(scenario())
+
+
+def test_requests_without_a_key_always_run():
+    async def scenario():
+        table = FakeKeyTable()
+        store = worker(table)
+        shortener = Shortener()
+        await store.run("shorten", None, ("url",), shortener, ShortenResponse)
+        await store.run("shorten", None, ("url",), shortener, ShortenResponse)
+        assert shortener.calls == 2
+        assert table.queries == 0
+
+    asyncio.run(scenario())
+
+
+def test_expired_keys_run_again():
+    async def scenario():
+        table = FakeKeyTable()
+        shortener = Shortener()
+        await shorten(worker(table, ttl=0), shortener)
+        await asyncio.sleep(0.001)
+        await shorten(worker(table), shortener)
+        assert shortener.calls == 2
+
+    asyncio.run(scenario())
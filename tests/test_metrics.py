@@ -0,0 +1,76 @@
+import pytest
+
+import project.metrics
+
+
+def rendered_lines():
+    return project.metrics.render_metrics().splitlines()
+
+
+def test_metric_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        project.metrics._Metric("test_untyped", "An untyped metric.")
+
+
+def test_counter_renders_help_type_and_labelled_samples():
+    counter = project.metrics.Counter(
+        "test_counter_requests_total", "Requests served.", ["endpoint"]
+    )
+    counter.inc(endpoint="redirect")
+    counter.inc(2, endpoint="redirect")
+    counter.inc(endpoint="shorten")
+
+    assert counter.render().splitlines() == [
+        "# HELP test_counter_requests_total Requests served.",
+        "# TYPE test_counter_requests_total counter",
+        'test_counter_requests_total{endpoint="redirect"} 3.0',
+        'test_counter_requests_total{endpoint="shorten"} 1.0',
+    ]
+
+
+def test_gauge_goes_up_and_down():
+    gauge = project.metrics.Gauge("test_gauge_in_flight", "Requests in flight.")
+    gauge.set(5)
+    gauge.dec()
+    gauge.inc(0.5)
+
+    assert gauge.render().splitlines()[1:] == [
+        "# TYPE test_gauge_in_flight gauge",
+        "test_gauge_in_flight 4.5",
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = project.metrics.Counter(
+        "test_counter_escaped_total", "Escaping.", ["path"]
+    )
+    counter.inc(path='C:\\dir "quoted"')
+
+    assert counter.render().splitlines()[-1] == (
+        'test_counter_escaped_total{path="C:\\\\dir \\"quoted\\""} 1.0'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = project.metrics.Histogram(
+        "test_histogram_seconds", "Latency.", ["endpoint"], buckets=(1, 0.1)
+    )
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, endpoint="redirect")
+
+    assert histogram.render().splitlines()[2:] == [
+        'test_histogram_seconds_bucket{endpoint="redirect",le="0.1"} 2',
+        'test_histogram_seconds_bucket{endpoint="redirect",le="1"} 3',
+        'test_histogram_seconds_bucket{endpoint="redirect",le="+Inf"} 4',
+        'test_histogram_seconds_sum{endpoint="redirect"} 3.65',
+        'test_histogram_seconds_count{endpoint="redirect"} 4',
+    ]
+
+
+def test_render_metrics_includes_every_registered_metric():
+    project.metrics.Counter("test_registry_total", "Registered.").inc()
+    lines = rendered_lines()
+
+    assert "# TYPE test_registry_total counter" in lines
+    assert "test_registry_total 1.0" in lines
+    assert project.metrics.render_metrics().endswith("\n")
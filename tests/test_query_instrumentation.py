@@ -0,0 +1,79 @@
+import pytest
+
+import project.query_instrumentation
+from project.query_instrumentation import collect_query_stats, record_query
+
+
+@pytest.fixture
+def thresholds(monkeypatch):
+    monkeypatch.setattr(project.query_instrumentation, "SLOW_QUERY_MS", 100)
+    monkeypatch.setattr(project.query_instrumentation, "N_PLUS_ONE_THRESHOLD", 3)
+
+
+def counted(counter, model, action):
+    return counter._values.get((model, action), 0)
+
+
+def test_queries_are_tallied_per_request(thresholds):
+    with collect_query_stats() as stats:
+        record_query("Url", "find_unique", 0.002)
+        record_query("Analytics", "find_many", 0.003)
+    record_query("Url", "find_unique", 0.001)
+
+    assert stats.count == 2
+    assert stats.total_ms == pytest.approx(5)
+    assert stats.by_operation == {
+        ("Url", "find_unique"): 1,
+        ("Analytics", "find_many"): 1,
+    }
+
+
+def test_repeated_operation_is_flagged_once_per_request(thresholds):
+    flagged = project.query_instrumentation.db_n_plus_one_total
+    before = counted(flagged, "NPlusOne", "find_unique")
+
+    with collect_query_stats() as stats:
+        for _ in range(10):
+            record_query("NPlusOne", "find_unique", 0.001)
+        record_query("NPlusOne", "update", 0.001)
+    assert stats.flagged == {("NPlusOne", "find_unique")}
+    assert counted(flagged, "NPlusOne", "find_unique") == before + 1
+
+    with collect_query_stats():
+        for _ in range(3):
+            record_query("NPlusOne", "find_unique", 0.001)
+    assert counted(flagged, "NPlusOne", "find_unique") == before + 2
+
+
+def test_queries_outside_a_request_are_never_flagged(thresholds):
+    flagged = project.query_instrumentation.db_n_plus_one_total
+    before = counted(flagged, "Background", "find_many")
+
+    for _ in range(10):
+        record_query("Background", "find_many", 0.001)
+
+    assert counted(flagged, "Background", "find_many") == before
+
+
+def test_only_queries_at_or_over_the_threshold_count_as_slow(thresholds, caplog):
+    slow = project.query_instrumentation.db_slow_queries_total
+    before = counted(slow, "Slow", "find_many")
+
+    record_query("Slow", "find_many", 0.099)
+    record_query("Slow", "find_many", 0.1)
+    record_query("Slow", "find_many", 2.5)
+
+    assert counted(slow, "Slow", "find_many") == before + 2
+    assert "Slow query Slow.find_many took 2500.0ms" in caplog.text
+
+
+def test_every_query_is_counted_and_timed(thresholds):
+    total = project.query_instrumentation.db_queries_total
+    before = counted(total, "Timed", "create")
+
+    record_query("Timed", "create", 0.004)
+
+    assert counted(total, "Timed", "create") == before + 1
+    histogram = project.query_instrumentation.db_query_duration_seconds
+    bucket = histogram.buckets.index(0.005)
+    assert histogram._counts[("Timed", "create")][bucket] >= 1
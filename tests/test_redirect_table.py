@@ -0,0 +1,158 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import project.redirect_table
+import project.sharding
+from project.redirect_repository import UrlMapping
+
+BUILT_AT = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+def mapping(alias, **fields):
+    return UrlMapping(
+        id=fields.pop("id", f"id-{alias}"),
+        originalUrl=fields.pop("originalUrl", f"https://example.com/{alias}"),
+        alias=alias,
+        updatedAt=fields.pop("updatedAt", BUILT_AT - timedelta(days=1)),
+        **fields,
+    )
+
+
+def load(tmp_path, mappings):
+    path = str(tmp_path / "redirects.bin")
+    written = project.redirect_table.write_redirect_table(path, mappings, BUILT_AT)
+    return written, project.redirect_table.RedirectTable(path)
+
+
+def test_lookup_returns_every_written_mapping(tmp_path):
+    expires = datetime(2030, 1, 1, 12, 30, tzinfo=timezone.utc)
+    mappings = [mapping(f"alias{i}") for i in range(200)]
+    mappings.append(mapping("expiring", expiresAt=expires))
+    written, table = load(tmp_path, mappings)
+
+    assert written == len(mappings)
+    for expected in mappings:
+        found = table.lookup(expected.alias)
+        assert found.id == expected.id
+        assert found.originalUrl == expected.originalUrl
+        assert found.alias == expected.alias
+        assert found.expiresAt == expected.expiresAt
+        assert found.updatedAt == expected.updatedAt
+
+
+def test_lookup_misses_unknown_aliases(tmp_path):
+    _, table = load(tmp_path, [mapping("known")])
+
+    assert table.lookup("unknown") is None
+    assert table.lookup("know") is None
+
+
+def test_mappings_without_alias_are_skipped(tmp_path):
+    written, table = load(tmp_path, [mapping(None, id="no-alias"), mapping("kept")])
+
+    assert written == 1
+    assert table.lookup("kept").id == "id-kept"
+
+
+def test_non_ascii_aliases_and_urls_round_trip(tmp_path):
+    _, table = load(
+        tmp_path, [mapping("café", originalUrl="https://example.com/ünïcode")]
+    )
+
+    assert table.lookup("café").originalUrl == "https://example.com/ünïcode"
+
+
+def test_empty_table_misses_everything(tmp_path):
+    written, table = load(tmp_path, [])
+
+    assert written == 0
+    assert table.lookup("anything") is None
+
+
+def test_missing_file_misses_everything(tmp_path):
+    table = project.redirect_table.RedirectTable(str(tmp_path / "absent.bin"))
+
+    assert table.lookup("anything") is None
+
+
+def test_overlay_is_consulted_before_the_table(tmp_path):
+    _, table = load(tmp_path, [mapping("moved")])
+    table.record_write(mapping("moved", originalUrl="https://example.com/new"))
+    table.record_write(mapping("fresh"))
+
+    assert table.lookup("moved").originalUrl == "https://example.com/new"
+    assert table.lookup("fresh").id == "id-fresh"
+
+
+def test_writer_streams_batches_and_cleans_up(tmp_path):
+    path = str(tmp_path / "redirects.bin")
+    writer = project.redirect_table.RedirectTableWriter(path, BUILT_AT)
+    updated = project.redirect_table._to_micros(BUILT_AT)
+    writer.add([(f"a{i}", f"id{i}", f"https://a/{i}", None, updated) for i in range(9)])
+    writer.add(
+        [(f"b{i}", f"id{i}", f"https://b/{i}", updated, updated) for i in range(50)]
+    )
+    writer.add([])
+
+    assert writer.finish() == 59
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["redirects.bin"]
+    table = project.redirect_table.RedirectTable(path)
+    assert table.lookup("a7").originalUrl == "https://a/7"
+    assert table.lookup("b49").expiresAt == BUILT_AT
+
+
+def test_aborted_writer_leaves_the_old_table(tmp_path):
+    _, table = load(tmp_path, [mapping("kept")])
+    writer = project.redirect_table.RedirectTableWriter(table.path, BUILT_AT)
+    writer.add([("lost", "id", "https://example.com/", None, 0)])
+    writer.abort()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["redirects.bin"]
+    assert table.lookup("kept").id == "id-kept"
+    assert table.lookup("lost") is None
+
+
+class FakeUrlTable:
+    def __init__(self, rows):
+        self.rows = rows
+        self.pages = 0
+
+    @asynccontextmanager
+    async def tx(self, timeout):
+        yield self
+
+    async def execute_raw(self, sql):
+        assert sql.startswith("SET LOCAL statement_timeout")
+
+    async def query_raw(self, sql, last_id, limit):
+        assert sql is project.redirect_table.ACTIVE_MAPPINGS_PAGE_SQL
+        self.pages += 1
+        return [row for row in self.rows if row["id"] > last_id][:limit]
+
+
+def test_rebuild_streams_every_page_of_every_database(tmp_path, monkeypatch):
+    def rows(prefix, count):
+        return [
+            {
+                "id": f"{prefix}{i:03}",
+                "alias": f"{prefix}-alias{i}",
+                "originalUrl": f"https://example.com/{prefix}{i}",
+                "expires": None,
+                "updated": 0,
+            }
+            for i in range(count)
+        ]
+
+    databases = [FakeUrlTable(rows("a", 5)), FakeUrlTable(rows("b", 2))]
+    monkeypatch.setattr(project.redirect_table, "REBUILD_PAGE_SIZE", 2)
+    monkeypatch.setattr(project.sharding, "database_clients", lambda: databases)
+    path = str(tmp_path / "redirects.bin")
+
+    written = asyncio.run(project.redirect_table.rebuild_redirect_table(path))
+
+    assert written == 7
+    assert [database.pages for database in databases] == [3, 2]
+    table = project.redirect_table.RedirectTable(path)
+    assert table.lookup("a-alias4").id == "a004"
+    assert table.lookup("b-alias1").originalUrl == "https://example.com/b1"
@@ -0,0 +1,164 @@
+import asyncio
+import sys
+
+import pytest
+
+import project.sampling_profiler_service
+from project.sampling_profiler_service import (
+    ProfileAlreadyRunningError,
+    _SamplingSession,
+    track_request,
+    verify_admin_token,
+)
+
+
+def session(route=None, match_header=None):
+    return _SamplingSession(0.01, route, match_header)
+
+
+@pytest.fixture
+def active_session(monkeypatch):
+    def activate(**kwargs):
+        active = session(**kwargs)
+        monkeypatch.setattr(project.sampling_profiler_service, "_session", active)
+        return active
+
+    return activate
+
+
+def test_route_filter_matches_path_prefixes():
+    filtered = session(route="/url/")
+
+    assert filtered.matches("/url/abc", {})
+    assert not filtered.matches("/analytics/abc", {})
+
+
+def test_header_filter_matches_name_or_name_and_value():
+    by_name = session(match_header="X-Profile")
+    by_value = session(match_header="X-Profile = canary")
+
+    assert by_name.matches("/", {"x-profile": "anything"})
+    assert not by_name.matches("/", {})
+    assert by_value.matches("/", {"x-profile": "canary"})
+    assert not by_value.matches("/", {"x-profile": "other"})
+
+
+def test_route_and_header_filters_must_both_match():
+    filtered = session(route="/url/", match_header="x-profile")
+
+    assert filtered.matches("/url/abc", {"x-profile": "1"})
+    assert not filtered.matches("/url/abc", {})
+    assert not filtered.matches("/auth/login", {"x-profile": "1"})
+
+
+def test_unfiltered_session_matches_everything():
+    unfiltered = session()
+
+    assert not unfiltered.filtered
+    assert unfiltered.matches("/anything", {})
+
+
+def test_track_request_counts_matching_requests_in_flight(active_session):
+    active = active_session(route="/url/")
+
+    with track_request("/url/abc", {}):
+        assert active.matching_in_flight == 1
+        with track_request("/url/def", {}):
+            assert active.matching_in_flight == 2
+        with track_request("/auth/login", {}):
+            assert active.matching_in_flight == 1
+    assert active.matching_in_flight == 0
+
+
+def test_track_request_releases_on_errors(active_session):
+    active = active_session(route="/url/")
+
+    with pytest.raises(RuntimeError):
+        with track_request("/url/abc", {}):
+            raise RuntimeError("handler failed")
+
+    assert active.matching_in_flight == 0
+
+
+def test_track_request_ignores_unfiltered_sessions(active_session):
+    active = active_session()
+
+    with track_request("/url/abc", {}):
+        assert active.matching_in_flight == 0
+
+
+def test_track_request_without_a_session_is_a_no_op():
+    assert project.sampling_profiler_service._session is None
+    with track_request("/url/abc", {}):
+        pass
+
+
+def test_collapse_renders_frames_root_first():
+    def outer():
+        return inner()
+
+    def inner():
+        return project.sampling_profiler_service._collapse(sys._getframe())
+
+    stack = outer().split(";")
+
+    assert stack[-2:] == [f"{__name__}:outer", f"{__name__}:inner"]
+    assert stack.index(f"{__name__}:test_collapse_renders_frames_root_first") == (
+        len(stack) - 3
+    )
+
+
+def test_collapse_caps_the_stack_depth(monkeypatch):
+    monkeypatch.setattr(project.sampling_profiler_service, "MAX_STACK_DEPTH", 2)
+
+    def outer():
+        return inner()
+
+    def inner():
+        return project.sampling_profiler_service._collapse(sys._getframe())
+
+    assert outer() == f"{__name__}:outer;{__name__}:inner"
+
+
+@pytest.mark.parametrize(
+    "configured, supplied",
+    [("", ""), ("", "anything"), ("secret", None), ("secret", ""), ("secret", "guess")],
+)
+def test_admin_token_is_rejected(monkeypatch, configured, supplied):
+    monkeypatch.setenv("ADMIN_API_TOKEN", configured)
+
+    with pytest.raises(PermissionError):
+        verify_admin_token(supplied)
+
+
+def test_admin_token_is_rejected_when_not_configured(monkeypatch):
+    monkeypatch.delenv("ADMIN_API_TOKEN", raising=False)
+
+    with pytest.raises(PermissionError):
+        verify_admin_token("anything")
+
+
+def test_matching_admin_token_is_accepted(monkeypatch):
+    monkeypatch.setenv("ADMIN_API_TOKEN", "secret")
+
+    verify_admin_token("secret")
+
+
+def test_second_profile_in_a_worker_is_refused():
+    async def scenario():
+        first = asyncio.create_task(
+            project.sampling_profiler_service.run_sampling_profile(0.05, 1)
+        )
+        await asyncio.sleep(0)
+        with pytest.raises(ProfileAlreadyRunningError):
+            await project.sampling_profiler_service.run_sampling_profile(0.05, 1)
+        profile = await first
+        assert profile.duration_seconds >= 0.05
+        assert project.sampling_profiler_service._session is None
+
+    asyncio.run(scenario())
+
+
+def test_profile_duration_must_be_positive():
+    with pytest.raises(ValueError):
+        asyncio.run(project.sampling_profiler_service.run_sampling_profile(0, 1))
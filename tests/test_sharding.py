@@ -0,0 +1,47 @@
+from collections import Counter
+
+import pytest
+
+import project.sharding
+from project.sharding import HashRing
+
+KEYS = [f"alias{i}" for i in range(20000)]
+
+
+def test_keys_spread_evenly_over_shards():
+    ring = HashRing(["s1", "s2", "s3", "s4"])
+    owners = Counter(ring.shard_for(key) for key in KEYS)
+
+    assert set(owners) == {"s1", "s2", "s3", "s4"}
+    for count in owners.values():
+        assert abs(count - len(KEYS) / 4) < len(KEYS) * 0.05
+
+
+def test_adding_a_shard_only_moves_keys_onto_it():
+    before = HashRing(["s1", "s2", "s3", "s4"])
+    after = HashRing(["s1", "s2", "s3", "s4", "s5"])
+    moved = [key for key in KEYS if before.shard_for(key) != after.shard_for(key)]
+
+    assert all(after.shard_for(key) == "s5" for key in moved)
+    assert abs(len(moved) - len(KEYS) / 5) < len(KEYS) * 0.05
+
+
+def test_placement_does_not_depend_on_shard_order():
+    ring = HashRing(["s1", "s2", "s3"])
+    reordered = HashRing(["s3", "s1", "s2"])
+
+    assert all(ring.shard_for(key) == reordered.shard_for(key) for key in KEYS)
+
+
+def test_ring_needs_a_shard():
+    with pytest.raises(ValueError):
+        HashRing([])
+
+
+def test_parse_shard_urls():
+    assert project.sharding.parse_shard_urls(
+        " s1=postgresql://a/db?x=1 , s2=postgresql://b/db,"
+    ) == {"s1": "postgresql://a/db?x=1", "s2": "postgresql://b/db"}
+    assert project.sharding.parse_shard_urls("") == {}
+    with pytest.raises(ValueError):
+        project.sharding.parse_shard_urls("postgresql://a/db")